@@ -0,0 +1,115 @@
+import re
+from typing import Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.sparse import csr_matrix
+
+CHUNK_SIZE = 10000
+# The alphabetic tokens that gensim's simple_preprocess looks for
+TOKEN_PATTERN = re.compile(r"(?:(?![\d])\w)+")
+
+
+def preprocess(document: str) -> List[str]:
+    """
+    The same tokens as gensim's simple_preprocess with its default settings, in a single regex pass
+    """
+    return [token for token in TOKEN_PATTERN.findall(document.lower()) if 2 <= len(token) <= 15 and token[0] != "_"]
+
+
+def tokenize(documents: List[str], workers: int = 1) -> List[List[str]]:
+    """
+    Preprocess the documents, splitting the work across processes if workers > 1
+    """
+    if workers <= 1 or len(documents) <= CHUNK_SIZE:
+        return [preprocess(document) for document in documents]
+    chunks = [documents[i:i + CHUNK_SIZE] for i in range(0, len(documents), CHUNK_SIZE)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [tokens for chunk in pool.map(tokenize, chunks) for tokens in chunk]
+
+
+class DocumentEncoder:
+    """
+    Turns documents into the average of their word2vec word vectors, for a whole batch at once.
+    Each document's words are mapped to rows of the embedding matrix, and the averages are
+    computed as a single sparse matrix multiplication: a documents x vocabulary matrix holding
+    1/n for each of a document's n words, times the vocabulary x dimensions embedding matrix.
+    Words that aren't in the vocabulary are skipped; a document with none gets a vector of zeros.
+    """
+
+    def __init__(self, keyed_vectors):
+        """
+        :param keyed_vectors: the wv of a trained gensim Word2Vec model
+        """
+        self.index: Dict[str, int] = keyed_vectors.key_to_index
+        self.vectors = keyed_vectors.vectors
+        self.vector_size = keyed_vectors.vector_size
+
+    def weights(self, token_lists: List[List[str]]) -> csr_matrix:
+        """
+        The sparse documents x vocabulary matrix of averaging weights
+        """
+        index = self.index
+        columns, indptr = [], [0]
+        for tokens in token_lists:
+            columns.extend(index[token] for token in tokens if token in index)
+            indptr.append(len(columns))
+        indptr = np.array(indptr, dtype=np.int64)
+        counts = np.diff(indptr)
+        data = np.repeat(1.0 / np.maximum(counts, 1), counts).astype(self.vectors.dtype)
+        shape = (len(token_lists), len(self.vectors))
+        return csr_matrix((data, np.array(columns, dtype=np.int64), indptr), shape=shape)
+
+    def encode_tokens(self, token_lists: List[List[str]]) -> np.ndarray:
+        """
+        Document vectors for documents that have already been split into tokens, like processed_docs
+        """
+        return np.asarray(self.weights(token_lists) @ self.vectors)
+
+    def encode(self, documents: List[str], workers: int = 1) -> np.ndarray:
+        """
+        Document vectors for a list of documents, one row each
+        :param documents: the raw text of each document
+        :param workers: processes to tokenize with; worthwhile for hundreds of thousands of documents
+        """
+        return self.encode_tokens(tokenize(documents, workers))
+
+
+class BatchPredictor:
+    """
+    A pricer built from a DocumentEncoder and a trained regressor, that scores a whole
+    test set with one encode and one predict call.
+    It can also be called with a single item, like the other pricers, so it works with Tester:
+    call prime with the test items first, and each call then just looks up the precomputed price.
+    """
+
+    def __init__(self, encoder: DocumentEncoder, regressor, name: Optional[str] = None):
+        """
+        :param encoder: turns the items' test prompts into document vectors
+        :param regressor: any trained model with a scikit-learn predict method
+        :param name: the name that Tester shows in its chart title
+        """
+        self.encoder = encoder
+        self.regressor = regressor
+        self.__name__ = name or f"{type(regressor).__name__}_pricer"
+        self.primed: Dict[str, float] = {}
+
+    def predict(self, items, workers: int = 1) -> np.ndarray:
+        """
+        Estimate the prices of all the items at once; negative estimates become zero
+        """
+        vectors = self.encoder.encode([item.test_prompt() for item in items], workers)
+        return np.maximum(self.regressor.predict(vectors), 0)
+
+    def prime(self, items, workers: int = 1):
+        """
+        Price these items in one batch, ready for calls one at a time
+        """
+        prompts = [item.test_prompt() for item in items]
+        self.primed.update(zip(prompts, self.predict(items, workers).tolist()))
+        return self
+
+    def __call__(self, item) -> float:
+        prompt = item.test_prompt()
+        if prompt in self.primed:
+            return self.primed[prompt]
+        return float(self.predict([item])[0])
@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+from typing import List, Optional
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+FEATURE_COLUMNS = ['weight', 'rank', 'text_length', 'is_top_electronics_brand']
+TOP_ELECTRONICS_BRANDS = ["hp", "dell", "lenovo", "samsung", "asus", "sony", "canon", "apple", "intel"]
+CACHE_DIR = "features"
+
+# Multiply the amount by these to get pounds
+WEIGHT_UNITS = {
+    "pounds": 1.0,
+    "ounces": 1 / 16,
+    "grams": 1 / 453.592,
+    "milligrams": 1 / 453592,
+    "kilograms": 1 / 0.453592,
+    "hundredths": 1 / 100,
+}
+WEIGHT_PATTERN = r"^\s*([0-9]*\.?[0-9]+)\s+(\S+)\s*(\S*)"
+
+
+def parse_details(items) -> List[dict]:
+    """
+    Parse the details JSON of every item once, with orjson if it's installed
+    """
+    return [loads(item.details) if item.details else {} for item in items]
+
+
+def fingerprint(items) -> str:
+    """
+    A short hash of the items, so a cached feature matrix is only reused for the same data
+    """
+    digest = hashlib.sha1()
+    for item in items:
+        digest.update((item.details or "").encode())
+        digest.update(item.prompt.encode())
+    return digest.hexdigest()[:16]
+
+
+def weights_in_pounds(weights: pd.Series) -> np.ndarray:
+    """
+    Convert strings like "1.5 pounds", "12 ounces" or "35 hundredths pounds" to pounds, all at once
+    Anything that can't be understood becomes NaN
+    """
+    parts = weights.str.extract(WEIGHT_PATTERN)
+    amounts = pd.to_numeric(parts[0], errors="coerce")
+    units = parts[1].str.lower()
+    factors = units.map(WEIGHT_UNITS)
+    factors[(units == "hundredths") & (parts[2].str.lower() != "pounds")] = np.nan
+    return (amounts * factors).to_numpy(dtype=np.float64)
+
+
+class FeaturePipeline:
+    """
+    Extracts the hand-crafted features for the traditional linear regression pricer from a whole list of items at once.
+    Each item's details are parsed a single time, and then each feature is computed as one columnar operation.
+    Missing weights and ranks are filled in with the averages from the training set, learned by fit.
+    The raw feature matrix for a named set of items is cached to disk, keyed by a fingerprint of the items.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = CACHE_DIR):
+        """
+        :param cache_dir: where to keep cached feature matrices, or None not to cache
+        """
+        self.cache_dir = cache_dir
+        self.average_weight = None
+        self.average_rank = None
+
+    def cache_path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, f"{name}.npz")
+
+    def extract(self, items) -> np.ndarray:
+        """
+        The raw features, one row per item, with NaN for a missing weight or rank
+        """
+        details = parse_details(items)
+        weights = pd.Series([features.get("Item Weight") for features in details], dtype=object)
+        ranks = [features.get("Best Sellers Rank") for features in details]
+        brands = pd.Series([features.get("Brand") for features in details], dtype=object)
+        matrix = np.empty((len(items), len(FEATURE_COLUMNS)), dtype=np.float64)
+        matrix[:, 0] = weights_in_pounds(weights)
+        matrix[:, 1] = [sum(rank.values()) / len(rank) if rank else np.nan for rank in ranks]
+        matrix[:, 2] = [len(item.test_prompt()) for item in items]
+        matrix[:, 3] = brands.str.lower().isin(TOP_ELECTRONICS_BRANDS).to_numpy()
+        return matrix
+
+    def raw(self, items, name: Optional[str] = None) -> np.ndarray:
+        """
+        The raw features, read from the cache when this named set of items has been seen before
+        :param items: the items to extract features from
+        :param name: a name for the cache file, like train or test; without one, nothing is cached
+        """
+        if not name or not self.cache_dir:
+            return self.extract(items)
+        key = fingerprint(items)
+        path = self.cache_path(name)
+        if os.path.exists(path):
+            cached = np.load(path)
+            if str(cached["fingerprint"]) == key:
+                return cached["features"]
+        matrix = self.extract(items)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        np.savez(path, features=matrix, fingerprint=np.array(key))
+        return matrix
+
+    def fit(self, items, name: Optional[str] = "train"):
+        """
+        Learn the average weight and rank of the training items, used to fill in missing values
+        """
+        matrix = self.raw(items, name)
+        self.average_weight = float(np.nanmean(np.where(matrix[:, 0] > 0, matrix[:, 0], np.nan)))
+        self.average_rank = float(np.nanmean(np.where(matrix[:, 1] > 0, matrix[:, 1], np.nan)))
+        return self
+
+    def transform(self, items, name: Optional[str] = None) -> np.ndarray:
+        """
+        The feature matrix, with missing (or zero) weights and ranks replaced by the training averages
+        """
+        if self.average_weight is None:
+            raise ValueError("The pipeline must be fitted to the training items before it can transform")
+        matrix = self.raw(items, name).copy()
+        for column, average in ((0, self.average_weight), (1, self.average_rank)):
+            values = matrix[:, column]
+            values[np.isnan(values) | (values == 0)] = average
+        return matrix
+
+    def fit_transform(self, items, name: Optional[str] = "train") -> np.ndarray:
+        return self.fit(items, name).transform(items, name)
+
+    def dataframe(self, items, name: Optional[str] = None) -> pd.DataFrame:
+        """
+        The features in a DataFrame with named columns, along with each item's price
+        """
+        df = pd.DataFrame(self.transform(items, name), columns=FEATURE_COLUMNS)
+        df['price'] = np.array([item.price for item in items], dtype=np.float64)
+        return df
@@ -1,11 +1,12 @@
 from pydantic import BaseModel
-from typing import List, Dict, Self
+from typing import List, Dict, Optional, Self
 from bs4 import BeautifulSoup
 import re
 import feedparser
 from tqdm import tqdm
 import requests
 import time
+import asyncio
 
 feeds = [
     "https://www.dealnews.com/c142/Electronics/?rss=1",
@@ -15,6 +16,9 @@ feeds = [
         "https://www.dealnews.com/c196/Home-Garden/?rss=1",
        ]
 
+# How many pages to request at once when fetching asynchronously, to stay polite to the site
+FETCH_CONCURRENCY = 4
+
 def extract(html_snippet: str) -> str:
     """
     Use Beautiful Soup to clean up this HTML snippet and extract useful text
@@ -42,14 +46,16 @@ class ScrapedDeal:
     details: str
     features: str
 
-    def __init__(self, entry: Dict[str, str]):
+    def __init__(self, entry: Dict[str, str], page: Optional[bytes] = None):
         """
         Populate this instance based on the provided dict
+        :param entry: the entry from the RSS feed
+        :param page: the deal's web page, if it's already been fetched; otherwise it's requested here
         """
         self.title = entry['title']
         self.summary = extract(entry['summary'])
         self.url = entry['links'][0]['href']
-        stuff = requests.get(self.url).content
+        stuff = page if page is not None else requests.get(self.url).content
         soup = BeautifulSoup(stuff, 'html.parser')
         content = soup.find('div', class_='content-section').get_text()
         content = content.replace('\nmore', '').replace('\n', ' ')
@@ -85,6 +91,32 @@ class ScrapedDeal:
                 time.sleep(0.5)
         return deals
 
+    @classmethod
+    async def fetch_async(cls, session, concurrency: int = FETCH_CONCURRENCY) -> List[Self]:
+        """
+        Retrieve all deals from the selected RSS feeds, fetching feeds and pages concurrently
+        rather than one after another, with at most concurrency requests in flight at once
+        :param session: the aiohttp ClientSession to make requests with
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def get(url: str) -> bytes:
+            async with semaphore:
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    return await response.read()
+
+        async def deals_from(feed_url: str) -> List[Self]:
+            feed = feedparser.parse(await get(feed_url))
+            entries = feed.entries[:10]
+            async with asyncio.TaskGroup() as group:
+                pages = [group.create_task(get(entry['links'][0]['href'])) for entry in entries]
+            return [cls(entry, page.result()) for entry, page in zip(entries, pages)]
+
+        async with asyncio.TaskGroup() as group:
+            tasks = [group.create_task(deals_from(feed_url)) for feed_url in feeds]
+        return [deal for task in tasks for deal in task.result()]
+
 class Deal(BaseModel):
     """
     A class to Represent a Deal with a summary description
@@ -1,48 +1,212 @@
-import pandas as pd
-from sklearn.linear_model import LinearRegression
+import os
+import asyncio
+from concurrent.futures import Future
+from functools import cached_property
+from typing import List, Optional, Sequence
+import numpy as np
 import joblib
 
 from agents.agent import Agent
 from agents.specialist_agent import SpecialistAgent
 from agents.frontier_agent import FrontierAgent
 from agents.random_forest_agent import RandomForestAgent
+from agents.startup import StartupProfile
+
+ENSEMBLE_FILE = "ensemble_model.pkl"
+ENSEMBLE_WITHOUT_SPECIALIST_FILE = "ensemble_model_without_specialist.pkl"
+
+class LinearCombiner:
+    """
+    The ensemble's trained LinearRegression reduced to its coefficients and intercept,
+    so that combining the estimates is a dot product rather than a DataFrame and a predict call
+    """
+
+    FEATURES = ['Specialist', 'Frontier', 'RandomForest', 'Min', 'Max']
+    FEATURES_WITHOUT_SPECIALIST = ['Frontier', 'RandomForest', 'Min', 'Max']
+
+    def __init__(self, coefficients: Sequence[float], intercept: float, names: Sequence[str] = FEATURES):
+        self.names = list(names)
+        self.coefficients = [float(c) for c in coefficients]
+        self.intercept = float(intercept)
+        self.weights = np.array(self.coefficients)
+
+    @classmethod
+    def from_model(cls, model, names: Sequence[str] = FEATURES):
+        """
+        Take the coefficients from a fitted LinearRegression, such as the one saved in ensemble_model.pkl,
+        in the order of names whatever order the model was trained with
+        :param names: the features the model should have been trained on; FEATURES, or FEATURES_WITHOUT_SPECIALIST
+        """
+        trained = list(getattr(model, "feature_names_in_", names))
+        if sorted(trained) != sorted(names):
+            raise ValueError(f"Expected an ensemble model trained on {list(names)}, got {trained}")
+        coefficients = dict(zip(trained, model.coef_))
+        return cls([coefficients[name] for name in names], model.intercept_, names)
+
+    @staticmethod
+    def features(specialist: float, frontier: float, random_forest: float) -> List[float]:
+        return [specialist, frontier, random_forest, min(specialist, frontier, random_forest), max(specialist, frontier, random_forest)]
+
+    @staticmethod
+    def features_without_specialist(frontier: float, random_forest: float) -> List[float]:
+        return [frontier, random_forest, min(frontier, random_forest), max(frontier, random_forest)]
+
+    def predict_one(self, features: Sequence[float]) -> float:
+        return self.intercept + sum(c * x for c, x in zip(self.coefficients, features))
+
+    def predict(self, rows) -> np.ndarray:
+        """
+        Combine many rows of features at once
+        :param rows: an array with a row per product and a column per feature, in the order of names
+        """
+        return np.asarray(rows, dtype=np.float64) @ self.weights + self.intercept
+
+
+def load_optional(filename: str):
+    """
+    Load a pickled model if the file exists, otherwise None
+    """
+    return joblib.load(filename) if os.path.exists(filename) else None
+
 
 class EnsembleAgent(Agent):
 
     name = "Ensemble Agent"
     color = Agent.YELLOW
     
-    def __init__(self, collection):
+    def __init__(self, collection, profile: Optional[StartupProfile] = None):
         """
         Create an instance of Ensemble, by creating each of the models
         And loading the weights of the Ensemble
+        The models and weights load concurrently in the background, and this returns straight away;
+        each one is waited for the first time it's used
+        :param profile: the StartupProfile to load and time them with; by default, one of its own
+        """
+        self.log("Initializing Ensemble Agent - loading its models in the background")
+        if profile is None:
+            profile = StartupProfile()
+            profile.seal(lambda report: self.log(f"Ensemble Agent is {report}"))
+        self.loading = {
+            "specialist": profile.submit("Specialist Agent", SpecialistAgent),
+            "frontier": profile.submit("Frontier Agent", lambda: FrontierAgent(collection)),
+            "random_forest": profile.submit("Random Forest Agent", RandomForestAgent),
+            "model": profile.submit("Ensemble weights", lambda: joblib.load(ENSEMBLE_FILE)),
+            "model_without_specialist": profile.submit("Ensemble weights without the specialist",
+                                                       lambda: load_optional(ENSEMBLE_WITHOUT_SPECIALIST_FILE)),
+        }
+
+    @property
+    def specialist(self) -> SpecialistAgent:
+        return self.loading["specialist"].result()
+
+    @property
+    def frontier(self) -> FrontierAgent:
+        return self.loading["frontier"].result()
+
+    @property
+    def random_forest(self) -> RandomForestAgent:
+        return self.loading["random_forest"].result()
+
+    @property
+    def model(self):
+        return self.loading["model"].result()
+
+    @property
+    def model_without_specialist(self):
+        return self.loading["model_without_specialist"].result()
+
+    @cached_property
+    def combiner(self) -> LinearCombiner:
+        return LinearCombiner.from_model(self.model)
+
+    @cached_property
+    def combiner_without_specialist(self) -> Optional[LinearCombiner]:
+        """
+        The combiner trained on the frontier and random forest estimates alone, by train_models.py;
+        None if it hasn't been trained
+        """
+        model = self.model_without_specialist
+        return None if model is None else LinearCombiner.from_model(model, LinearCombiner.FEATURES_WITHOUT_SPECIALIST)
+
+    def can_skip_specialist(self, use_specialist: bool) -> bool:
+        """
+        Whether to price without the specialist: only when asked to, and when there's a combiner trained for it.
+        The main combiner was trained on the specialist's real estimates, so nothing may stand in for one
+        """
+        if use_specialist:
+            return False
+        if self.combiner_without_specialist is None:
+            self.log(f"Ensemble Agent has no {ENSEMBLE_WITHOUT_SPECIALIST_FILE} - waiting for the specialist instead")
+            return False
+        self.log("Ensemble Agent is deferring the specialist as its model is cold")
+        return True
+
+    def wait_until_ready(self):
+        """
+        Wait for all the models to load, raising the error if one of them failed
+        """
+        for future in self.loading.values():
+            future.result()
+
+    async def ready_async(self):
+        """
+        Wait for all the models to load without blocking the event loop
         """
-        self.log("Initializing Ensemble Agent")
-        self.specialist = SpecialistAgent()
-        self.frontier = FrontierAgent(collection)
-        self.random_forest = RandomForestAgent()
-        self.model = joblib.load('ensemble_model.pkl')
-        self.log("Ensemble Agent is ready")
+        for future in self.loading.values():
+            await asyncio.wrap_future(future)
 
-    def price(self, description: str) -> float:
+    def warm_up(self):
+        """
+        Start the specialist's remote model warming up, as soon as the specialist has loaded, without waiting for it
+        """
+        def warm_up(future: Future):
+            if not future.exception():
+                future.result().warm_up()
+        self.loading["specialist"].add_done_callback(warm_up)
+
+    def price(self, description: str, use_specialist: bool = True) -> float:
         """
         Run this ensemble model
         Ask each of the models to price the product
         Then use the Linear Regression model to return the weighted price
         :param description: the description of a product
+        :param use_specialist: if False, the specialist isn't called - for example while it's cold -
+        and the other two estimates are combined by the ensemble trained without it, if there is one
         :return: an estimate of its price
         """
         self.log("Running Ensemble Agent - collaborating with specialist, frontier and random forest agents")
-        specialist = self.specialist.price(description)
         frontier = self.frontier.price(description)
         random_forest = self.random_forest.price(description)
-        X = pd.DataFrame({
-            'Specialist': [specialist],
-            'Frontier': [frontier],
-            'RandomForest': [random_forest],
-            'Min': [min(specialist, frontier, random_forest)],
-            'Max': [max(specialist, frontier, random_forest)],
-        })
-        y = self.model.predict(X)[0]
+        if self.can_skip_specialist(use_specialist):
+            return self.combine_without_specialist(frontier, random_forest)
+        specialist = self.specialist.price(description)
+        return self.combine(specialist, frontier, random_forest)
+
+    async def price_async(self, description: str, use_specialist: bool = True) -> float:
+        """
+        Like price, but the three models are asked concurrently on the event loop.
+        If any of them fails, the others are cancelled and the error is raised
+        :param description: the description of a product
+        :param use_specialist: if False, the specialist isn't called, as for price
+        :return: an estimate of its price
+        """
+        self.log("Running Ensemble Agent - asking specialist, frontier and random forest agents concurrently")
+        await self.ready_async()
+        skip_specialist = self.can_skip_specialist(use_specialist)
+        async with asyncio.TaskGroup() as group:
+            frontier = group.create_task(self.frontier.price_async(description))
+            random_forest = group.create_task(self.random_forest.price_async(description))
+            specialist = None if skip_specialist else group.create_task(self.specialist.price_async(description))
+        if specialist is None:
+            return self.combine_without_specialist(frontier.result(), random_forest.result())
+        return self.combine(specialist.result(), frontier.result(), random_forest.result())
+
+    def combine(self, specialist: float, frontier: float, random_forest: float) -> float:
+        y = self.combiner.predict_one(LinearCombiner.features(specialist, frontier, random_forest))
         self.log(f"Ensemble Agent complete - returning ${y:.2f}")
-        return y
\ No newline at end of file
+        return y
+
+    def combine_without_specialist(self, frontier: float, random_forest: float) -> float:
+        y = self.combiner_without_specialist.predict_one(LinearCombiner.features_without_specialist(frontier, random_forest))
+        self.log(f"Ensemble Agent complete without the specialist - returning ${y:.2f}")
+        return y
@@ -4,8 +4,9 @@ import os
 import re
 import math
 import json
+import asyncio
 from typing import List, Dict
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from sentence_transformers import SentenceTransformer
 from datasets import load_dataset
 import chromadb
@@ -28,6 +29,7 @@ class FrontierAgent(Agent):
         """
         self.log("Initializing Frontier Agent")
         self.openai = OpenAI()
+        self.async_openai = AsyncOpenAI()
         self.collection = collection
         self.model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
         self.log("Frontier Agent is ready")
@@ -102,4 +104,24 @@ class FrontierAgent(Agent):
         result = self.get_price(reply)
         self.log(f"Frontier Agent completed - predicting ${result:.2f}")
         return result
-        
\ No newline at end of file
+        
+
+    async def price_async(self, description: str) -> float:
+        """
+        Like price, without blocking the event loop: the RAG search runs on a worker thread,
+        and OpenAI is called with the async client
+        :param description: a description of the product
+        :return: an estimate of the price
+        """
+        documents, prices = await asyncio.to_thread(self.find_similars, description)
+        self.log("Frontier Agent is about to call OpenAI with context including 5 similar products")
+        response = await self.async_openai.chat.completions.create(
+            model=self.MODEL,
+            messages=self.messages_for(description, documents, prices),
+            seed=42,
+            max_tokens=5
+        )
+        reply = response.choices[0].message.content
+        result = self.get_price(reply)
+        self.log(f"Frontier Agent completed - predicting ${result:.2f}")
+        return result
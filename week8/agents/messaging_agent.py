@@ -1,25 +1,31 @@
 import os
+import asyncio
+import threading
+from typing import List
 # from twilio.rest import Client
 from agents.deals import Opportunity
-import http.client
-import urllib
 from agents.agent import Agent
+from agents.pushover import PushoverTransport, PushoverError
 
 # Uncomment the Twilio lines if you wish to use Twilio
 
 DO_TEXT = False
 DO_PUSH = True
+# Send one alert per run listing every deal found, rather than an alert for each deal as it's found
+DIGEST = False
+PUSH_TIMEOUT = 10
 
 class MessagingAgent(Agent):
 
     name = "Messaging Agent"
     color = Agent.WHITE
 
-    def __init__(self):
+    def __init__(self, digest: bool = DIGEST):
         """
         Set up this object to either do push notifications via Pushover,
         or SMS via Twilio,
         whichever is specified in the constants
+        :param digest: hold alerts until flush is called, then send them all as one message
         """
         self.log(f"Messaging Agent is initializing")
         if DO_TEXT:
@@ -32,7 +38,11 @@ class MessagingAgent(Agent):
         if DO_PUSH:
             self.pushover_user = os.getenv('PUSHOVER_USER', 'your-pushover-user-if-not-using-env')
             self.pushover_token = os.getenv('PUSHOVER_TOKEN', 'your-pushover-user-if-not-using-env')
+            self.pushover = PushoverTransport(self.pushover_token, self.pushover_user, timeout=PUSH_TIMEOUT)
             self.log("Messaging Agent has initialized Pushover")
+        self.digest = digest
+        self.held: List[Opportunity] = []
+        self.held_lock = threading.Lock()
 
     def message(self, text):
         """
@@ -47,33 +57,113 @@ class MessagingAgent(Agent):
 
     def push(self, text):
         """
-        Send a Push Notification using the Pushover API
+        Send a Push Notification using the Pushover API, over a kept-alive connection
+        A notification that can't be delivered is logged rather than raised, so it doesn't stop a run
         """
         self.log("Messaging Agent is sending a push notification")
-        conn = http.client.HTTPSConnection("api.pushover.net:443")
-        conn.request("POST", "/1/messages.json",
-          urllib.parse.urlencode({
-            "token": self.pushover_token,
-            "user": self.pushover_user,
-            "message": text,
-            "sound": "cashregister"
-          }), { "Content-type": "application/x-www-form-urlencoded" })
-        conn.getresponse()
+        try:
+            self.pushover.send(text, sound="cashregister")
+        except PushoverError as e:
+            self.log(f"Messaging Agent could not send a push notification: {e}")
 
-    def alert(self, opportunity: Opportunity):
+    async def push_async(self, text, session):
         """
-        Make an alert about the specified Opportunity
+        Send a Push Notification using the Pushover API, without blocking the event loop
+        Retried as push is, and logged rather than raised if it can't be delivered
+        :param session: the aiohttp ClientSession to send it with
         """
+        self.log("Messaging Agent is sending a push notification")
+        try:
+            await self.pushover.send_async(text, session, sound="cashregister")
+        except PushoverError as e:
+            self.log(f"Messaging Agent could not send a push notification: {e}")
+
+    def alert_text(self, opportunity: Opportunity) -> str:
         text = f"Deal Alert! Price=${opportunity.deal.price:.2f}, "
         text += f"Estimate=${opportunity.estimate:.2f}, "
         text += f"Discount=${opportunity.discount:.2f} :"
         text += opportunity.deal.product_description[:10]+'... '
         text += opportunity.deal.url
+        return text
+
+    def digest_text(self, opportunities: List[Opportunity]) -> str:
+        """
+        One message for several opportunities, the biggest discount first
+        """
+        ranked = sorted(opportunities, key=lambda opp: opp.discount, reverse=True)
+        lines = [f"{len(ranked)} Deal Alerts!"]
+        for opp in ranked:
+            lines.append(f"${opp.deal.price:.2f} (est. ${opp.estimate:.2f}, save ${opp.discount:.2f}) "
+                         f"{opp.deal.product_description[:40]}... {opp.deal.url}")
+        return "\n".join(lines)
+
+    def hold(self, opportunity: Opportunity) -> bool:
+        """
+        In digest mode, keep the opportunity for the next flush
+        :return: True if it was held, False if it should be sent now
+        """
+        if not self.digest:
+            return False
+        with self.held_lock:
+            self.held.append(opportunity)
+        self.log("Messaging Agent is holding an alert for the digest")
+        return True
+
+    def take_held(self) -> List[Opportunity]:
+        with self.held_lock:
+            held, self.held = self.held, []
+        return held
+
+    def flush(self):
+        """
+        In digest mode, send every alert held since the last flush as a single message; otherwise there's nothing to do
+        """
+        held = self.take_held()
+        if not held:
+            return
+        text = self.alert_text(held[0]) if len(held) == 1 else self.digest_text(held)
+        self.send(text)
+
+    async def flush_async(self, session):
+        """
+        Like flush, without blocking the event loop
+        :param session: the aiohttp ClientSession to send push notifications with
+        """
+        held = self.take_held()
+        if not held:
+            return
+        text = self.alert_text(held[0]) if len(held) == 1 else self.digest_text(held)
+        await self.send_async(text, session)
+
+    def send(self, text: str):
         if DO_TEXT:
             self.message(text)
         if DO_PUSH:
             self.push(text)
         self.log("Messaging Agent has completed")
+
+    async def send_async(self, text: str, session):
+        if DO_TEXT:
+            await asyncio.to_thread(self.message, text)
+        if DO_PUSH:
+            await self.push_async(text, session)
+        self.log("Messaging Agent has completed")
+
+    async def alert_async(self, opportunity: Opportunity, session):
+        """
+        Make an alert about the specified Opportunity, without blocking the event loop
+        :param session: the aiohttp ClientSession to send push notifications with
+        """
+        if not self.hold(opportunity):
+            await self.send_async(self.alert_text(opportunity), session)
+
+    def alert(self, opportunity: Opportunity, immediately: bool = False):
+        """
+        Make an alert about the specified Opportunity; in digest mode, it's sent with the others at the next flush
+        :param immediately: send it now even in digest mode, as for an alert the user asked for
+        """
+        if immediately or not self.hold(opportunity):
+            self.send(self.alert_text(opportunity))
         
     
         
\ No newline at end of file
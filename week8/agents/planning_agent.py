@@ -1,9 +1,16 @@
-from typing import Optional, List
+import queue
+import asyncio
+import threading
+import aiohttp
+from itertools import islice
+from contextlib import aclosing
+from typing import Optional, List, Callable
 from agents.agent import Agent
 from agents.deals import ScrapedDeal, DealSelection, Deal, Opportunity
 from agents.scanner_agent import ScannerAgent
 from agents.ensemble_agent import EnsembleAgent
 from agents.messaging_agent import MessagingAgent
+from agents.startup import StartupProfile
 
 
 class PlanningAgent(Agent):
@@ -11,47 +18,189 @@ class PlanningAgent(Agent):
     name = "Planning Agent"
     color = Agent.GREEN
     DEAL_THRESHOLD = 50
+    MAX_DEALS = 5
+    PRICING_WORKERS = 3
+    QUEUE_SIZE = 5
 
-    def __init__(self, collection):
+    def __init__(self, collection, profile: Optional[StartupProfile] = None):
         """
         Create instances of the 3 Agents that this planner coordinates across
+        The ensemble's models load in the background, so scanning can begin while they do
+        :param profile: the StartupProfile to load and time the agents with; by default, one of its own
         """
         self.log("Planning Agent is initializing")
-        self.scanner = ScannerAgent()
-        self.ensemble = EnsembleAgent(collection)
-        self.messenger = MessagingAgent()
+        sealed = profile is None
+        profile = profile or StartupProfile()
+        self.scanner = profile.timed("Scanner Agent", ScannerAgent)
+        self.ensemble = EnsembleAgent(collection, profile)
+        self.messenger = profile.timed("Messaging Agent", MessagingAgent)
+        if sealed:
+            profile.seal(lambda report: self.log(f"Planning Agent is {report}"))
         self.log("Planning Agent is ready")
 
     def run(self, deal: Deal) -> Opportunity:
         """
         Run the workflow for a particular deal
+        If the specialist's remote model is still cold, the ensemble prices without it rather than wait,
+        when it has a combiner trained for that; it logs which it did
         :param deal: the deal, summarized from an RSS scrape
         :returns: an opportunity including the discount
         """
         self.log("Planning Agent is pricing up a potential deal")
-        estimate = self.ensemble.price(deal.product_description)
+        use_specialist = self.ensemble.specialist.is_ready()
+        estimate = self.ensemble.price(deal.product_description, use_specialist=use_specialist)
         discount = estimate - deal.price
         self.log(f"Planning Agent has processed a deal with discount ${discount:.2f}")
         return Opportunity(deal=deal, estimate=estimate, discount=discount)
 
-    def plan(self, memory: List[str] = []) -> Optional[Opportunity]:
+    async def run_async(self, deal: Deal) -> Opportunity:
         """
-        Run the full workflow:
-        1. Use the ScannerAgent to find deals from RSS feeds
-        2. Use the EnsembleAgent to estimate them
-        3. Use the MessagingAgent to send a notification of deals
+        Like run, but pricing the deal without blocking the event loop
+        """
+        self.log("Planning Agent is pricing up a potential deal")
+        await self.ensemble.ready_async()
+        use_specialist = self.ensemble.specialist.is_ready()
+        estimate = await self.ensemble.price_async(deal.product_description, use_specialist=use_specialist)
+        discount = estimate - deal.price
+        self.log(f"Planning Agent has processed a deal with discount ${discount:.2f}")
+        return Opportunity(deal=deal, estimate=estimate, discount=discount)
+
+    def plan(self, memory: List[str] = [], on_surfaced: Optional[Callable[[Opportunity], None]] = None) -> Optional[Opportunity]:
+        """
+        Run the full workflow as a pipeline, so each deal moves on to the next stage as soon as it's ready:
+        1. The ScannerAgent streams deals from RSS feeds, each one as soon as OpenAI has selected it
+        2. A few workers estimate them with the EnsembleAgent, in parallel
+        3. The MessagingAgent sends a notification for each deal that clears DEAL_THRESHOLD, as soon as it's priced,
+           or one digest of them all at the end of the run if it's in digest mode
+        The stages are connected by bounded queues, so a stage that falls behind holds back the one before it
         :param memory: a list of URLs that have been surfaced in the past
-        :return: an Opportunity if one was surfaced, otherwise None
+        :param on_surfaced: called with each opportunity as soon as it has been alerted
+        :return: the best Opportunity surfaced, or None if there wasn't one
         """
         self.log("Planning Agent is kicking off a run")
-        selection = self.scanner.scan(memory=memory)
-        if selection:
-            opportunities = [self.run(deal) for deal in selection.deals[:5]]
-            opportunities.sort(key=lambda opp: opp.discount, reverse=True)
-            best = opportunities[0]
-            self.log(f"Planning Agent has identified the best deal has discount ${best.discount:.2f}")
-            if best.discount > self.DEAL_THRESHOLD:
-                self.messenger.alert(best)
-            self.log("Planning Agent has completed a run")
-            return best if best.discount > self.DEAL_THRESHOLD else None
-        return None
\ No newline at end of file
+        self.ensemble.warm_up()
+        deals = queue.Queue(maxsize=self.QUEUE_SIZE)
+        priced = queue.Queue(maxsize=self.QUEUE_SIZE)
+        errors = []
+
+        def scan():
+            try:
+                for deal in islice(self.scanner.scan_stream(memory=memory), self.MAX_DEALS):
+                    deals.put(deal)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                for _ in range(self.PRICING_WORKERS):
+                    deals.put(None)
+
+        def price():
+            while (deal := deals.get()) is not None:
+                try:
+                    priced.put(self.run(deal))
+                except Exception as e:
+                    self.log(f"Planning Agent could not price a deal: {e}")
+            priced.put(None)
+
+        workers = [threading.Thread(target=scan, daemon=True)]
+        workers += [threading.Thread(target=price, daemon=True) for _ in range(self.PRICING_WORKERS)]
+        for worker in workers:
+            worker.start()
+
+        best = None
+        finished = 0
+        while finished < self.PRICING_WORKERS:
+            opportunity = priced.get()
+            if opportunity is None:
+                finished += 1
+                continue
+            if opportunity.discount <= self.DEAL_THRESHOLD:
+                continue
+            self.log(f"Planning Agent has found a deal with discount ${opportunity.discount:.2f} - alerting now")
+            try:
+                self.messenger.alert(opportunity)
+                if on_surfaced:
+                    on_surfaced(opportunity)
+            except Exception as e:
+                self.log(f"Planning Agent could not alert a deal: {e}")
+                errors.append(e)
+            if best is None or opportunity.discount > best.discount:
+                best = opportunity
+        for worker in workers:
+            worker.join()
+        try:
+            self.messenger.flush()
+        except Exception as e:
+            errors.append(e)
+        if errors:
+            raise errors[0]
+        self.log("Planning Agent has completed a run")
+        return best
+
+    async def plan_async(self, memory: List[str] = [], on_surfaced: Optional[Callable[[Opportunity], None]] = None) -> Optional[Opportunity]:
+        """
+        The same pipeline as plan, run as tasks on one event loop rather than threads:
+        feeds are fetched concurrently, every selected deal is priced concurrently as it streams in,
+        and each deal that clears DEAL_THRESHOLD is alerted as soon as it's priced.
+        The tasks run in a TaskGroup, so if the scan fails, or the run is cancelled,
+        everything still in progress is cancelled with it. As in plan, a failed alert doesn't stop the run:
+        the other deals are still priced and alerted. Either way the digest is still flushed, and then
+        the first error is raised as it was, rather than in an ExceptionGroup
+        :param memory: a list of URLs that have been surfaced in the past
+        :param on_surfaced: called with each opportunity as soon as it has been alerted
+        :return: the best Opportunity surfaced, or None if there wasn't one
+        """
+        self.log("Planning Agent is kicking off an async run")
+        self.ensemble.warm_up()
+        deals = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        surfaced = []
+        errors = []
+
+        async with aiohttp.ClientSession() as session:
+
+            async def scan():
+                count = 0
+                async with aclosing(self.scanner.scan_stream_async(memory, session)) as stream:
+                    async for deal in stream:
+                        await deals.put(deal)
+                        count += 1
+                        if count >= self.MAX_DEALS:
+                            break
+                for _ in range(self.MAX_DEALS):
+                    await deals.put(None)
+
+            async def price():
+                while (deal := await deals.get()) is not None:
+                    try:
+                        opportunity = await self.run_async(deal)
+                    except Exception as e:
+                        self.log(f"Planning Agent could not price a deal: {e}")
+                        continue
+                    if opportunity.discount > self.DEAL_THRESHOLD:
+                        self.log(f"Planning Agent has found a deal with discount ${opportunity.discount:.2f} - alerting now")
+                        surfaced.append(opportunity)
+                        try:
+                            await self.messenger.alert_async(opportunity, session)
+                            if on_surfaced:
+                                on_surfaced(opportunity)
+                        except Exception as e:
+                            self.log(f"Planning Agent could not alert a deal: {e}")
+                            errors.append(e)
+
+            try:
+                async with asyncio.TaskGroup() as group:
+                    group.create_task(scan())
+                    for _ in range(self.MAX_DEALS):
+                        group.create_task(price())
+            except* Exception as group_error:
+                # Raised below without the ExceptionGroup, so callers see the same error as from plan
+                errors.extend(group_error.exceptions)
+
+            try:
+                await self.messenger.flush_async(session)
+            except Exception as e:
+                errors.append(e)
+
+        if errors:
+            raise errors[0]
+        self.log("Planning Agent has completed an async run")
+        return max(surfaced, key=lambda opp: opp.discount) if surfaced else None
@@ -0,0 +1,138 @@
+import os
+import asyncio
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from pricer_model import PricerModel, PREFIX
+
+# Set this to the path of a GGUF export of the fine-tuned pricer to enable the local CPU fallback
+GGUF_PATH = os.getenv("PRICER_GGUF", "pricer.gguf")
+
+
+class PricerBackend(ABC):
+    """
+    A way of running the fine-tuned pricer model
+    SpecialistAgent works with any backend, so it can fall back to a local one
+    when the Modal service is cold or unavailable
+    """
+
+    name: str = "backend"
+
+    @abstractmethod
+    def price(self, description: str) -> float:
+        """
+        Estimate the price of the described product
+        """
+
+    async def price_async(self, description: str) -> float:
+        """
+        Estimate a price without blocking the event loop; by default on a worker thread
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.price, description)
+
+    def wake_up(self) -> str:
+        """
+        Make sure the model is loaded and ready to respond
+        """
+        return "ok"
+
+
+class ModalBackend(PricerBackend):
+    """
+    The Pricer class deployed to Modal by pricer_service2.py, running on a T4 GPU
+    """
+
+    name = "Modal T4"
+
+    def __init__(self, app_name: str = "pricer-service", class_name: str = "Pricer"):
+        import modal
+        Pricer = modal.Cls.lookup(app_name, class_name)
+        self.pricer = Pricer()
+
+    def price(self, description: str) -> float:
+        return self.pricer.price.remote(description)
+
+    async def price_async(self, description: str) -> float:
+        return await self.pricer.price.remote.aio(description)
+
+    def wake_up(self) -> str:
+        return self.pricer.wake_up.remote()
+
+
+class TransformersBackend(PricerBackend):
+    """
+    A PricerModel running in this process with Hugging Face transformers;
+    PricerModel.local() gives a tiny CPU model to exercise the code path without a GPU or Modal
+    """
+
+    name = "Transformers"
+
+    def __init__(self, model: Optional[PricerModel] = None):
+        self.model = model or PricerModel.local()
+
+    def price(self, description: str) -> float:
+        return self.model.price(description)
+
+    def wake_up(self) -> str:
+        self.model.load()
+        return "ok"
+
+
+class LlamaCppBackend(PricerBackend):
+    """
+    A GGUF-quantized copy of the fine-tuned pricer running on CPU through llama.cpp.
+    The GGUF file is made from the merged checkpoint written by merge_adapter.py,
+    converting it with llama.cpp's convert_hf_to_gguf.py, then quantizing it (for example to Q4_K_M).
+    A grammar limits the output to a number, like the numeric decoding mode of PricerModel.
+    A llama.cpp model can't be used from several threads at once, so loading it and every inference
+    run on one dedicated thread, and concurrent requests wait their turn.
+    Needs the optional llama-cpp-python package: pip install llama-cpp-python
+    """
+
+    name = "llama.cpp CPU"
+    GRAMMAR = r'root ::= [0-9]+ ("." [0-9]+)?'
+
+    def __init__(self, model_path: str = GGUF_PATH, threads: Optional[int] = None, context: int = 512):
+        """
+        :param model_path: the GGUF file to load
+        :param threads: CPU threads for llama.cpp to use, defaulting to all of them
+        :param context: the context window; our prompts are under 200 tokens
+        """
+        self.model_path = model_path
+        self.threads = threads or os.cpu_count()
+        self.context = context
+        self.llm = None
+        self.grammar = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llama-cpp")
+
+    @classmethod
+    def available(cls, model_path: str = GGUF_PATH) -> bool:
+        return os.path.exists(model_path)
+
+    def load(self):
+        """
+        Load the model if it isn't already; only called on the backend's own thread
+        """
+        if self.llm is None:
+            from llama_cpp import Llama, LlamaGrammar
+            self.llm = Llama(model_path=self.model_path, n_ctx=self.context, n_threads=self.threads, verbose=False)
+            self.grammar = LlamaGrammar.from_string(self.GRAMMAR, verbose=False)
+
+    def infer(self, description: str) -> float:
+        """
+        Price a description; only called on the backend's own thread
+        """
+        self.load()
+        prompt = PricerModel.prompt_for(description)
+        output = self.llm(prompt, max_tokens=5, temperature=0.0, grammar=self.grammar)
+        return PricerModel.get_price(PREFIX + output["choices"][0]["text"])
+
+    def wake_up(self) -> str:
+        self.executor.submit(self.load).result()
+        return "ok"
+
+    def price(self, description: str) -> float:
+        return self.executor.submit(self.infer, description).result()
+
+    async def price_async(self, description: str) -> float:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.infer, description)
@@ -0,0 +1,142 @@
+import time
+import logging
+import threading
+import statistics
+from collections import deque
+from typing import Optional
+
+
+class PricerWarmer:
+    """
+    Keeps the remote Pricer warm, and measures whether it is.
+    Every call to the pricer is recorded, so the warmer only pings it after it has been idle
+    for longer than idle_threshold seconds. Calls slower than cold_threshold seconds count
+    as cold starts. The pricer is considered ready while the last successful call is more
+    recent than Modal's scaledown window, after which its container will have gone away.
+    Works with any PricerBackend
+    """
+
+    IDLE_THRESHOLD = 45
+    COLD_THRESHOLD = 10.0
+    SCALEDOWN_WINDOW = 60
+    INTERVAL = 5
+    MAX_BACKOFF = 300
+
+    def __init__(self, backend, idle_threshold: float = IDLE_THRESHOLD, cold_threshold: float = COLD_THRESHOLD,
+                 scaledown_window: float = SCALEDOWN_WINDOW, interval: float = INTERVAL):
+        """
+        :param backend: the PricerBackend to keep warm
+        :param idle_threshold: ping the pricer once it's been idle for this many seconds
+        :param cold_threshold: a call slower than this many seconds is counted as a cold start
+        :param scaledown_window: how long Modal keeps an idle container before scaling it down
+        :param interval: how often the background thread checks whether a ping is due
+        """
+        self.backend = backend
+        self.idle_threshold = idle_threshold
+        self.cold_threshold = cold_threshold
+        self.scaledown_window = scaledown_window
+        self.interval = interval
+        self.warm_latencies = deque(maxlen=100)
+        self.cold_latencies = deque(maxlen=100)
+        self.last_success: Optional[float] = None
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.waking = None
+
+    def record(self, latency: float) -> None:
+        """
+        Note a successful call to the pricer that took this many seconds
+        """
+        with self.lock:
+            if latency > self.cold_threshold:
+                self.cold_latencies.append(latency)
+            else:
+                self.warm_latencies.append(latency)
+            self.last_success = time.monotonic()
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            self.last_success = None
+
+    def idle_for(self) -> float:
+        """
+        Seconds since the last successful call, or infinity if there hasn't been one
+        """
+        with self.lock:
+            return float("inf") if self.last_success is None else time.monotonic() - self.last_success
+
+    def is_ready(self) -> bool:
+        """
+        True if the pricer should answer without a cold start
+        """
+        return self.idle_for() < self.scaledown_window
+
+    def ping(self) -> float:
+        """
+        Call wake_up on the backend, recording how long it took
+        """
+        start = time.perf_counter()
+        try:
+            self.backend.wake_up()
+        except Exception:
+            self.record_failure()
+            raise
+        latency = time.perf_counter() - start
+        self.record(latency)
+        return latency
+
+    def wake(self) -> None:
+        """
+        Start a ping in the background, unless one is already under way
+        Used by the planner to overlap a cold start with other work
+        """
+        if self.waking and self.waking.is_alive():
+            return
+        self.waking = threading.Thread(target=self.check, kwargs={"force": True}, daemon=True)
+        self.waking.start()
+
+    def check(self, force: bool = False) -> Optional[float]:
+        """
+        Ping the pricer if it's been idle too long; return the latency, or None if no ping was needed or it failed
+        """
+        if not force and self.idle_for() < self.idle_threshold:
+            return None
+        try:
+            return self.ping()
+        except Exception as e:
+            logging.warning(f"Pricer keep-warm ping failed: {e}")
+            return None
+
+    def backoff(self) -> float:
+        """
+        How long to wait before the next check, backing off exponentially after failures
+        """
+        with self.lock:
+            failures = self.failures
+        return min(self.MAX_BACKOFF, self.interval * 2 ** failures)
+
+    def run(self) -> None:
+        while not self.stopping.is_set():
+            self.check()
+            self.stopping.wait(self.backoff())
+
+    def start(self):
+        if not self.thread or not self.thread.is_alive():
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.stopping.set()
+
+    def summary(self) -> str:
+        with self.lock:
+            warm, cold = list(self.warm_latencies), list(self.cold_latencies)
+        warm_text = f"warm median {statistics.median(warm):.2f}s over {len(warm)}" if warm else "no warm calls"
+        cold_text = f"cold median {statistics.median(cold):.2f}s over {len(cold)}" if cold else "no cold starts"
+        return f"{'ready' if self.is_ready() else 'cold'}; {warm_text}; {cold_text}"
@@ -0,0 +1,201 @@
+import os
+import ssl
+import json
+import time
+import queue
+import select
+import asyncio
+import logging
+import http.client
+import urllib.parse
+from typing import Optional
+import aiohttp
+
+PUSHOVER_HOST = "api.pushover.net"
+PUSHOVER_PORT = 443
+PUSHOVER_PATH = "/1/messages.json"
+
+
+class PushoverError(Exception):
+    """
+    A notification couldn't be delivered: Pushover rejected it, or it failed after every retry
+    """
+
+
+class PushoverTransport:
+    """
+    Sends Pushover notifications over a small pool of persistent HTTPS connections, so only the first
+    notification pays for the TCP and TLS handshakes; later ones reuse a connection that's still open.
+    Every request has a timeout. Pushover's POST isn't idempotent, so a notification is only retried when
+    it's known not to have been sent - the connection couldn't be made, or it failed while the request was
+    being written - or when Pushover answered that it's rate limited or had a server error; retries back off
+    exponentially. Once a request has been sent, a missing response isn't retried, as it may have been delivered.
+    Pooled connections that the server has closed while they were idle are discarded before they're used.
+    send_async applies the same policy over an aiohttp session.
+    The host and port default to Pushover's, but can be set with PUSHOVER_HOST and PUSHOVER_PORT, so that
+    it can be pointed at a local stand-in; pass an ssl context that trusts the stand-in's certificate.
+    """
+
+    HEADERS = {"Content-type": "application/x-www-form-urlencoded"}
+
+    def __init__(self, token: str, user: str, host: Optional[str] = None, port: Optional[int] = None,
+                 timeout: float = 10, retries: int = 3, backoff: float = 0.5, pool_size: int = 2,
+                 context: Optional[ssl.SSLContext] = None):
+        """
+        :param token: the Pushover application token
+        :param user: the Pushover user key
+        :param timeout: seconds to wait for a connection or a response
+        :param retries: how many times to retry a notification that wasn't sent, or was refused for a reason that might pass
+        :param backoff: seconds to wait before the first retry, doubling for each one after
+        :param pool_size: how many idle connections to keep open
+        :param context: the ssl context for the connections; by default, the system's trusted certificates
+        """
+        self.token = token
+        self.user = user
+        self.host = host or os.getenv("PUSHOVER_HOST", PUSHOVER_HOST)
+        self.port = int(port or os.getenv("PUSHOVER_PORT", PUSHOVER_PORT))
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.context = context
+        self.idle = queue.LifoQueue(maxsize=pool_size)
+
+    @property
+    def url(self) -> str:
+        return f"https://{self.host}:{self.port}{PUSHOVER_PATH}"
+
+    def connect(self) -> http.client.HTTPSConnection:
+        return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=self.context)
+
+    @staticmethod
+    def is_open(connection: http.client.HTTPSConnection) -> bool:
+        """
+        Whether an idle connection can still be used: nothing is expected on it between requests,
+        so if it's readable, the server has closed it
+        """
+        if connection.sock is None:
+            return False
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+        return not readable
+
+    def checkout(self) -> http.client.HTTPSConnection:
+        """
+        An open connection from the pool, or a new one if there isn't one
+        """
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                return self.connect()
+            if self.is_open(connection):
+                return connection
+            connection.close()
+
+    def release(self, connection: http.client.HTTPSConnection):
+        """
+        Keep a connection for the next notification, unless the pool is full
+        """
+        try:
+            self.idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def response(self, connection: http.client.HTTPSConnection):
+        """
+        Read the whole response to a request that has been sent, so the connection can be used again
+        :return: the status and the body of the response
+        """
+        try:
+            response = connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise PushoverError(f"No response from Pushover after sending the notification, "
+                                f"so it isn't retried in case it was delivered: {e}") from e
+        if response.will_close:
+            connection.close()
+        else:
+            self.release(connection)
+        return response.status, payload
+
+    def outcome(self, status: int, payload: bytes):
+        """
+        :return: Pushover's response if it accepted the notification, or a PushoverError if it's worth retrying
+        :raises PushoverError: if Pushover rejected the notification for a reason that won't pass
+        """
+        if 200 <= status < 300:
+            return json.loads(payload or b"{}")
+        error = PushoverError(f"Pushover responded with {status}: {payload[:200].decode(errors='replace')}")
+        if status != 429 and status < 500:
+            raise error
+        return error
+
+    def delay(self, attempt: int, error: PushoverError) -> float:
+        """
+        How long to wait before retrying after this error
+        :raises PushoverError: the error, if there are no retries left
+        """
+        if attempt >= self.retries:
+            raise error
+        delay = self.backoff * 2 ** attempt
+        logging.warning(f"{error} - retrying in {delay:.1f}s")
+        return delay
+
+    def fields(self, message: str, fields: dict) -> dict:
+        return {"token": self.token, "user": self.user, "message": message, **fields}
+
+    def send(self, message: str, **fields) -> dict:
+        """
+        Send a notification
+        :param message: the text of the notification
+        :param fields: any other Pushover parameters, such as title or sound
+        :return: Pushover's response
+        """
+        body = urllib.parse.urlencode(self.fields(message, fields))
+        attempt = 0
+        while True:
+            connection = self.checkout()
+            try:
+                connection.request("POST", PUSHOVER_PATH, body, self.HEADERS)
+            except (OSError, http.client.HTTPException) as e:
+                # The connection couldn't be made, or broke before the request was written, so nothing was sent
+                connection.close()
+                result = PushoverError(f"Could not reach Pushover: {e}")
+            else:
+                result = self.outcome(*self.response(connection))
+            if not isinstance(result, PushoverError):
+                return result
+            time.sleep(self.delay(attempt, result))
+            attempt += 1
+
+    async def send_async(self, message: str, session: aiohttp.ClientSession, **fields) -> dict:
+        """
+        Send a notification without blocking the event loop, retrying as send does
+        :param message: the text of the notification
+        :param session: the aiohttp ClientSession to send it with, which pools the connections
+        :param fields: any other Pushover parameters, such as title or sound
+        :return: Pushover's response
+        """
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        options = {"ssl": self.context} if self.context else {}
+        attempt = 0
+        while True:
+            try:
+                async with session.post(self.url, data=self.fields(message, fields), timeout=timeout, **options) as response:
+                    result = self.outcome(response.status, await response.read())
+            except aiohttp.ClientConnectorError as e:
+                result = PushoverError(f"Could not reach Pushover: {e}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise PushoverError(f"No response from Pushover, so the notification isn't retried "
+                                    f"in case it was delivered: {e}") from e
+            if not isinstance(result, PushoverError):
+                return result
+            await asyncio.sleep(self.delay(attempt, result))
+            attempt += 1
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
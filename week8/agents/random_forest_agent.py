@@ -2,10 +2,12 @@
 
 import os
 import re
+import asyncio
 from typing import List
 from sentence_transformers import SentenceTransformer
 import joblib
 from agents.agent import Agent
+from compiled_forest import CompiledForest, MODEL_FILE
 
 
 
@@ -18,10 +20,16 @@ class RandomForestAgent(Agent):
         """
         Initialize this object by loading in the saved model weights
         and the SentenceTransformer vector encoding model
+        The compiled forest is used if it has been built from the current model, as it loads
+        instantly with mmap and predicts faster; otherwise the pickled sklearn model is loaded
         """
         self.log("Random Forest Agent is initializing")
         self.vectorizer = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-        self.model = joblib.load('random_forest_model.pkl')
+        if CompiledForest.exists() and not CompiledForest().is_stale(MODEL_FILE):
+            self.log("Random Forest Agent is using the compiled forest")
+            self.model = CompiledForest()
+        else:
+            self.model = joblib.load(MODEL_FILE)
         self.log("Random Forest Agent is ready")
 
     def price(self, description: str) -> float:
@@ -34,4 +42,20 @@ class RandomForestAgent(Agent):
         vector = self.vectorizer.encode([description])
         result = max(0, self.model.predict(vector)[0])
         self.log(f"Random Forest Agent completed - predicting ${result:.2f}")
-        return result
\ No newline at end of file
+        return result
+
+    async def price_async(self, description: str) -> float:
+        """
+        Estimate the price on a worker thread, so the event loop isn't blocked by encoding and prediction
+        """
+        return await asyncio.to_thread(self.price, description)
+
+    def price_batch(self, descriptions: List[str]) -> List[float]:
+        """
+        Estimate the prices of many items with one encode and one predict call
+        :param descriptions: the products to be estimated
+        :return: a price for each description, in the same order
+        """
+        self.log(f"Random Forest Agent is pricing a batch of {len(descriptions)}")
+        vectors = self.vectorizer.encode(descriptions)
+        return [max(0, float(result)) for result in self.model.predict(vectors)]
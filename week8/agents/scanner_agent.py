@@ -1,8 +1,8 @@
 import os
 import json
-from typing import Optional, List
-from openai import OpenAI
-from agents.deals import ScrapedDeal, DealSelection
+from typing import Optional, List, Set, Iterator, AsyncIterator
+from openai import OpenAI, AsyncOpenAI
+from agents.deals import ScrapedDeal, DealSelection, Deal
 from agents.agent import Agent
 
 
@@ -44,17 +44,40 @@ class ScannerAgent(Agent):
         """
         self.log("Scanner Agent is initializing")
         self.openai = OpenAI()
+        self.async_openai = AsyncOpenAI()
         self.log("Scanner Agent is ready")
 
+    @staticmethod
+    def already_surfaced(memory, urls: List[str]) -> Set[str]:
+        """
+        Which of these URLs are in memory already
+        An OpportunityStore looks them up in its index; a list of opportunities is searched
+        """
+        if hasattr(memory, "known_urls"):
+            return memory.known_urls(urls)
+        return {opp.deal.url for opp in memory}.intersection(urls)
+
     def fetch_deals(self, memory) -> List[ScrapedDeal]:
         """
         Look up deals published on RSS feeds
         Return any new deals that are not already in the memory provided
         """
         self.log("Scanner Agent is about to fetch deals from RSS feed")
-        urls = [opp.deal.url for opp in memory]
         scraped = ScrapedDeal.fetch()
-        result = [scrape for scrape in scraped if scrape.url not in urls]
+        seen = self.already_surfaced(memory, [scrape.url for scrape in scraped])
+        result = [scrape for scrape in scraped if scrape.url not in seen]
+        self.log(f"Scanner Agent received {len(result)} deals not already scraped")
+        return result
+
+    async def fetch_deals_async(self, memory, session) -> List[ScrapedDeal]:
+        """
+        Like fetch_deals, but fetching all the feeds and pages concurrently
+        :param session: the aiohttp ClientSession to make requests with
+        """
+        self.log("Scanner Agent is about to fetch deals from RSS feeds concurrently")
+        scraped = await ScrapedDeal.fetch_async(session)
+        seen = self.already_surfaced(memory, [scrape.url for scrape in scraped])
+        result = [scrape for scrape in scraped if scrape.url not in seen]
         self.log(f"Scanner Agent received {len(result)} deals not already scraped")
         return result
 
@@ -91,4 +114,74 @@ class ScannerAgent(Agent):
             self.log(f"Scanner Agent received {len(result.deals)} selected deals with price>0 from OpenAI")
             return result
         return None
-                
+
+    def scan_stream(self, memory: List[str]=[]) -> Iterator[Deal]:
+        """
+        Like scan, but stream the response from OpenAI and yield each selected deal as soon as
+        the model has finished writing it, so it can be priced while the rest are still being written
+        :param memory: a list of URLs representing deals already raised
+        :return: an iterator over the selected deals with a price greater than 0
+        """
+        scraped = self.fetch_deals(memory)
+        if not scraped:
+            return
+        self.log("Scanner Agent is streaming from OpenAI using Structured Output")
+        emitted = 0
+        with self.openai.beta.chat.completions.stream(**self.stream_request(scraped)) as stream:
+            for event in stream:
+                for deal in self.completed_deals(event)[emitted:]:
+                    emitted += 1
+                    if deal.price > 0:
+                        yield deal
+            final = stream.get_final_completion().choices[0].message.parsed
+        deals = final.deals if final else []
+        for deal in deals[emitted:]:
+            if deal.price > 0:
+                yield deal
+        self.log(f"Scanner Agent streamed {len(deals)} selected deals from OpenAI")
+
+    async def scan_stream_async(self, memory: List[str], session) -> AsyncIterator[Deal]:
+        """
+        Like scan_stream, but without blocking the event loop: the feeds are fetched concurrently
+        with aiohttp, and the response is streamed with the async OpenAI client
+        :param memory: a list of URLs representing deals already raised
+        :param session: the aiohttp ClientSession to fetch feeds with
+        """
+        scraped = await self.fetch_deals_async(memory, session)
+        if not scraped:
+            return
+        self.log("Scanner Agent is streaming from OpenAI using Structured Output")
+        emitted = 0
+        async with self.async_openai.beta.chat.completions.stream(**self.stream_request(scraped)) as stream:
+            async for event in stream:
+                for deal in self.completed_deals(event)[emitted:]:
+                    emitted += 1
+                    if deal.price > 0:
+                        yield deal
+            final = (await stream.get_final_completion()).choices[0].message.parsed
+        deals = final.deals if final else []
+        for deal in deals[emitted:]:
+            if deal.price > 0:
+                yield deal
+        self.log(f"Scanner Agent streamed {len(deals)} selected deals from OpenAI")
+
+    def stream_request(self, scraped) -> dict:
+        return dict(
+            model=self.MODEL,
+            messages=[
+                {"role": "system", "content": self.SYSTEM_PROMPT},
+                {"role": "user", "content": self.make_user_prompt(scraped)}
+            ],
+            response_format=DealSelection
+        )
+
+    @staticmethod
+    def completed_deals(event) -> List[Deal]:
+        """
+        The deals in a partially streamed response that the model has finished writing,
+        which are all but the last, as a deal is only complete once the model has moved on to the next one
+        """
+        if event.type != "content.delta" or not isinstance(event.parsed, dict):
+            return []
+        deals = event.parsed.get("deals") or []
+        return [Deal(**deal) for deal in deals[:-1]]
@@ -1,5 +1,13 @@
-import modal
+import time
+import asyncio
+import threading
+import hashlib
+from collections import OrderedDict
+from typing import Optional
 from agents.agent import Agent
+from agents.pricer_warmer import PricerWarmer
+from agents.pricer_backends import PricerBackend, ModalBackend, LlamaCppBackend
+from pricer_model import REVISION
 
 
 class SpecialistAgent(Agent):
@@ -9,21 +17,161 @@ class SpecialistAgent(Agent):
 
     name = "Specialist Agent"
     color = Agent.RED
+    CACHE_SIZE = 10000
 
-    def __init__(self):
+    def __init__(self, backend: Optional[PricerBackend] = None, fallback: Optional[PricerBackend] = None,
+                 keep_warm: bool = False, allow_fallback: bool = True):
         """
         Set up this Agent by creating an instance of the modal class
+        :param backend: the PricerBackend to use; by default the pricer-service deployed on Modal
+        :param fallback: a backend to use while the main one is cold or failing; by default the local
+        llama.cpp backend, if a GGUF export of the model is present
+        :param keep_warm: whether to ping the main backend in the background whenever it's been idle for a while;
+        off by default, as this keeps a GPU running for as long as the agent exists - run keep_warm.py instead
+        to keep it warm deliberately
+        :param allow_fallback: if False, every estimate comes from the main backend, even while it's cold -
+        for example to train the ensemble on the same model it will be used with
         """
         self.log("Specialist Agent is initializing - connecting to modal")
-        Pricer = modal.Cls.lookup("pricer-service", "Pricer")
-        self.pricer = Pricer()
+        self.backend = backend or ModalBackend()
+        if fallback is None and allow_fallback and LlamaCppBackend.available():
+            fallback = LlamaCppBackend()
+        self.fallback = fallback if allow_fallback else None
+        self.warmer = PricerWarmer(self.backend)
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.in_flight = {}
+        self.waiters = {}
+        if keep_warm:
+            self.warmer.start()
         self.log("Specialist Agent is ready")
-        
+
+    def is_ready(self) -> bool:
+        """
+        True if pricing won't wait for a cold start: the remote model is warm, or there's a local fallback
+        """
+        return self.warmer.is_ready() or self.fallback is not None
+
+    def use_fallback(self) -> bool:
+        if self.fallback is not None and not self.warmer.is_ready():
+            self.log(f"Specialist Agent is using the {self.fallback.name} fallback while the remote model is cold")
+            self.warm_up()
+            return True
+        return False
+
+    def warm_up(self) -> None:
+        """
+        Wake up the remote model in the background
+        """
+        if not self.warmer.is_ready():
+            self.log("Specialist Agent is waking up the remote fine-tuned model")
+            self.warmer.wake()
+
+    def cache_key(self, description: str) -> str:
+        """
+        Estimates are cached by the description and the revision of the fine-tuned model that made them
+        """
+        return hashlib.sha256(f"{REVISION}\n{description}".encode("utf-8")).hexdigest()
+
+    def cached(self, key: str) -> Optional[float]:
+        with self.cache_lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+            return None
+
+    def remember(self, key: str, result: float) -> None:
+        with self.cache_lock:
+            self.cache[key] = result
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.CACHE_SIZE:
+                self.cache.popitem(last=False)
+
     def price(self, description: str) -> float:
         """
         Make a remote call to return the estimate of the price of this item
         """
+        key = self.cache_key(description)
+        result = self.cached(key)
+        if result is not None:
+            self.log(f"Specialist Agent found a cached estimate - predicting ${result:.2f}")
+            return result
+        if self.use_fallback():
+            result = self.fallback.price(description)
+            self.log(f"Specialist Agent completed - predicting ${result:.2f}")
+            return result
         self.log("Specialist Agent is calling remote fine-tuned model")
-        result = self.pricer.price.remote(description)
+        start = time.perf_counter()
+        try:
+            result = self.backend.price(description)
+        except Exception as e:
+            if self.fallback is None:
+                raise
+            self.warmer.record_failure()
+            self.log(f"Specialist Agent's remote call failed ({e}) - using the {self.fallback.name} fallback")
+            result = self.fallback.price(description)
+            self.log(f"Specialist Agent completed - predicting ${result:.2f}")
+            return result
+        self.warmer.record(time.perf_counter() - start)
+        self.remember(key, result)
         self.log(f"Specialist Agent completed - predicting ${result:.2f}")
         return result
+
+    async def remote_price(self, key: str, description: str) -> float:
+        """
+        Call the model without blocking the event loop, natively with Modal's .aio for the remote backend
+        Estimates from the fallback aren't cached, so the fine-tuned model is used once it's warm
+        """
+        if self.use_fallback():
+            result = await self.fallback.price_async(description)
+            self.log(f"Specialist Agent completed - predicting ${result:.2f}")
+            return result
+        self.log("Specialist Agent is calling remote fine-tuned model")
+        start = time.perf_counter()
+        try:
+            result = await self.backend.price_async(description)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self.fallback is None:
+                raise
+            self.warmer.record_failure()
+            self.log(f"Specialist Agent's remote call failed ({e}) - using the {self.fallback.name} fallback")
+            return await self.fallback.price_async(description)
+        self.warmer.record(time.perf_counter() - start)
+        self.remember(key, result)
+        self.log(f"Specialist Agent completed - predicting ${result:.2f}")
+        return result
+
+    async def price_async(self, description: str, timeout: Optional[float] = None) -> float:
+        """
+        Estimate the price of this item without blocking the event loop
+        Concurrent requests for the same description share a single remote call,
+        and results are cached. A caller that's cancelled or times out stops waiting;
+        the remote call itself is only cancelled once nobody is waiting for it.
+        :param description: the product to be estimated
+        :param timeout: the most seconds to wait, after which asyncio.TimeoutError is raised
+        """
+        key = self.cache_key(description)
+        result = self.cached(key)
+        if result is not None:
+            self.log(f"Specialist Agent found a cached estimate - predicting ${result:.2f}")
+            return result
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.remote_price(key, description))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            self.log("Specialist Agent is joining a request already in flight for this product")
+        self.waiters[key] = self.waiters.get(key, 0) + 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            if self.waiters[key] == 1:
+                task.cancel()
+            raise
+        finally:
+            self.waiters[key] -= 1
+            if not self.waiters[key]:
+                del self.waiters[key]
@@ -0,0 +1,79 @@
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+# The slow parts of starting up are reading models from disk and waiting on Modal, which release the GIL
+STARTUP_WORKERS = 6
+
+
+class StartupProfile:
+    """
+    Loads the heavy components of the agents - models, pickles, the Modal lookup - on background threads,
+    all at once, and times each of them.
+    Components are submitted as the agents are constructed, which returns immediately; an agent
+    waits on a component's future the first time it's needed. Once every component has been submitted,
+    seal is called with a callback, which receives a breakdown of the timings when the last one has loaded.
+    """
+
+    def __init__(self, workers: int = STARTUP_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="startup")
+        self.started = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.on_ready: Optional[Callable[[str], None]] = None
+
+    def submit(self, component: str, loader: Callable[[], T]) -> "Future[T]":
+        """
+        Start loading a component in the background
+        :param component: its name in the breakdown
+        :param loader: builds the component
+        :return: a future for the component
+        """
+        with self.lock:
+            self.pending += 1
+        return self.executor.submit(self.load, component, loader)
+
+    def load(self, component: str, loader: Callable[[], T]) -> T:
+        try:
+            return self.timed(component, loader)
+        finally:
+            with self.lock:
+                self.pending -= 1
+                ready = self.on_ready if not self.pending else None
+                if ready:
+                    self.on_ready = None
+            if ready:
+                self.executor.shutdown(wait=False)
+                ready(self.report())
+
+    def timed(self, component: str, loader: Callable[[], T]) -> T:
+        """
+        Build a component on this thread, recording how long it took, for components too quick to be worth a thread
+        """
+        start = time.perf_counter()
+        try:
+            return loader()
+        finally:
+            with self.lock:
+                self.timings[component] = time.perf_counter() - start
+
+    def seal(self, on_ready: Callable[[str], None]):
+        """
+        Say that every component has been submitted
+        :param on_ready: called with the report once they've all loaded, on the thread that loaded the last one
+        """
+        with self.lock:
+            if self.pending:
+                self.on_ready = on_ready
+                return
+        on_ready(self.report())
+
+    def report(self) -> str:
+        total = time.perf_counter() - self.started
+        breakdown = ", ".join(f"{component} {elapsed:.1f}s" for component, elapsed
+                              in sorted(self.timings.items(), key=lambda item: item[1], reverse=True))
+        return f"ready {total:.1f}s after starting: {breakdown}"
@@ -0,0 +1,52 @@
+import sys
+import time
+import pickle
+import statistics
+from dotenv import load_dotenv
+from items import Item
+from testing import Tester
+from agents.pricer_backends import ModalBackend, LlamaCppBackend
+
+# Compare latency and accuracy of the T4 pricer on Modal with the local llama.cpp CPU backend
+# on the Tester test set. Run with: python benchmark_backends.py [number of test items]
+
+
+def description(item):
+    return item.prompt.split("to the nearest dollar?\n\n")[1].split("\n\nPrice is $")[0]
+
+
+def benchmark(backend, data, size):
+    """
+    Run the Tester over this backend, timing every call
+    The first call is timed separately as it includes loading the model or a cold start
+    """
+    latencies = []
+
+    def predictor(item):
+        start = time.perf_counter()
+        result = backend.price(description(item))
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    predictor.__name__ = backend.name
+    start = time.perf_counter()
+    backend.wake_up()
+    startup = time.perf_counter() - start
+    Tester(predictor, data, size=size).run()
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{backend.name}: startup {startup:.1f}s, median {statistics.median(latencies)*1000:,.0f} ms, p95 {p95*1000:,.0f} ms per estimate")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 250
+    with open('test.pkl', 'rb') as file:
+        test = pickle.load(file)
+    backends = [ModalBackend()]
+    if LlamaCppBackend.available():
+        backends.append(LlamaCppBackend())
+    else:
+        print("No GGUF model found - set PRICER_GGUF to benchmark the llama.cpp backend")
+    for backend in backends:
+        benchmark(backend, test, size)
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+from typing import Optional
+import numpy as np
+
+MODEL_FILE = "random_forest_model.pkl"
+COMPILED_DIR = "random_forest_compiled"
+
+
+class CompiledForest:
+    """
+    A trained RandomForestRegressor flattened into a handful of NumPy arrays for fast inference.
+    Every node of every tree is a row in the same arrays: the feature and threshold it splits on,
+    the nodes to its left and right, and its value. A leaf points to itself on both sides.
+    Prediction walks all the trees at once: each step moves every (row, tree) pair one level
+    down with a few vectorised lookups, until they have all reached a leaf.
+    The arrays are saved as .npy files and opened with mmap, so loading is almost instant
+    and only the nodes that predictions actually visit are read from disk.
+    """
+
+    VERSION = 1
+    ARRAYS = ("left", "right", "feature", "threshold", "value", "roots")
+    METADATA = "metadata.json"
+
+    def __init__(self, path: str = COMPILED_DIR, mmap: bool = True):
+        """
+        Open a compiled forest
+        :param path: the directory it was compiled into
+        :param mmap: memory-map the arrays rather than reading them into memory
+        """
+        self.path = path
+        with open(os.path.join(path, self.METADATA), "r") as file:
+            self.metadata = json.load(file)
+        mode = "r" if mmap else None
+        for name in self.ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode))
+        self.n_features = self.metadata["n_features"]
+
+    @classmethod
+    def exists(cls, path: str = COMPILED_DIR) -> bool:
+        return os.path.exists(os.path.join(path, cls.METADATA))
+
+    @classmethod
+    def compile(cls, model, path: str = COMPILED_DIR, source: Optional[str] = None):
+        """
+        Flatten the trees of a fitted RandomForestRegressor and save them
+        :param model: the fitted forest, with a single output
+        :param path: the directory to write the arrays into
+        :param source: the file the model was loaded from, recorded in the metadata
+        :return: the compiled forest, opened from disk
+        """
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        sizes = np.array([tree.node_count for tree in trees], dtype=np.int64)
+        roots = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        total = int(sizes.sum())
+        if total >= 2 ** 31:
+            raise ValueError(f"The forest has {total:,} nodes, too many to index with int32")
+        left = np.empty(total, dtype=np.int32)
+        right = np.empty(total, dtype=np.int32)
+        feature = np.empty(total, dtype=np.int16 if model.n_features_in_ < 2 ** 15 else np.int32)
+        threshold = np.empty(total, dtype=np.float32)
+        value = np.empty(total, dtype=np.float64)
+        for tree, root, size in zip(trees, roots, sizes):
+            nodes = slice(root, root + size)
+            own = np.arange(root, root + size, dtype=np.int32)
+            leaf = tree.children_left == -1
+            left[nodes] = np.where(leaf, own, tree.children_left + root)
+            right[nodes] = np.where(leaf, own, tree.children_right + root)
+            feature[nodes] = np.where(leaf, 0, tree.feature)
+            # sklearn compares float32 inputs with float64 thresholds; rounding a threshold down
+            # to the largest float32 not above it gives exactly the same decisions in float32
+            thresholds = tree.threshold.astype(np.float32)
+            too_high = thresholds.astype(np.float64) > tree.threshold
+            thresholds[too_high] = np.nextafter(thresholds[too_high], np.float32(-np.inf))
+            threshold[nodes] = np.where(leaf, np.float32(np.inf), thresholds)
+            value[nodes] = tree.value[:, 0, 0]
+
+        os.makedirs(path, exist_ok=True)
+        arrays = dict(left=left, right=right, feature=feature, threshold=threshold, value=value, roots=roots)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        metadata = {
+            "version": cls.VERSION,
+            "n_trees": len(trees),
+            "n_nodes": total,
+            "n_features": int(model.n_features_in_),
+            "max_depth": int(max(tree.max_depth for tree in trees)),
+            "source": source,
+            "source_mtime": os.path.getmtime(source) if source and os.path.exists(source) else None,
+        }
+        with open(os.path.join(path, cls.METADATA), "w") as file:
+            json.dump(metadata, file, indent=2)
+        return cls(path)
+
+    def is_stale(self, source: str = MODEL_FILE) -> bool:
+        """
+        True if the pickled model has been retrained since this forest was compiled from it
+        """
+        return os.path.exists(source) and os.path.getmtime(source) != self.metadata.get("source_mtime")
+
+    def predict(self, X) -> np.ndarray:
+        """
+        Predict a value for each row of X, like RandomForestRegressor.predict
+        :param X: an array of shape (rows, features)
+        :return: the average of the trees' predictions for each row
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected an array of shape (rows, {self.n_features}), got {X.shape}")
+        rows = np.arange(len(X))[:, None]
+        nodes = np.repeat(np.asarray(self.roots, dtype=np.int32)[None, :], len(X), axis=0)
+        while True:
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            following = np.where(go_left, self.left[nodes], self.right[nodes])
+            if np.array_equal(following, nodes):
+                break
+            nodes = following
+        return self.value[nodes].mean(axis=1)
+
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+    def report(self) -> str:
+        return (f"Compiled forest of {self.metadata['n_trees']} trees, {self.metadata['n_nodes']:,} nodes, "
+                f"max depth {self.metadata['max_depth']}, {self.nbytes() / 1e6:,.1f} MB on disk")
+
+
+def resident_memory() -> int:
+    import psutil
+    return psutil.Process().memory_info().rss
+
+
+def benchmark(model_file: str = MODEL_FILE, path: str = COMPILED_DIR, batch_size: int = 256, repeats: int = 50):
+    """
+    Compare the pickled sklearn forest with the compiled one: load time, memory, and prediction latency
+    """
+    import joblib
+
+    n_features = CompiledForest(path).n_features
+    X = np.random.default_rng(42).normal(scale=0.05, size=(batch_size, n_features)).astype(np.float32)
+    results = {}
+    for name in ("sklearn", "compiled"):
+        memory = resident_memory()
+        start = time.perf_counter()
+        model = joblib.load(model_file) if name == "sklearn" else CompiledForest(path)
+        load = time.perf_counter() - start
+        model.predict(X[:1])
+        singles = []
+        for i in range(repeats):
+            start = time.perf_counter()
+            model.predict(X[i % batch_size:i % batch_size + 1])
+            singles.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        predictions = model.predict(X)
+        batch = time.perf_counter() - start
+        memory = resident_memory() - memory
+        results[name] = predictions
+        print(f"{name:9} load {load:7.2f}s, memory +{memory / 1e6:8,.1f} MB, "
+              f"single {np.median(singles) * 1000:7.2f} ms, batch of {batch_size} {batch * 1000:8.1f} ms")
+        del model
+    print(f"Largest difference between predictions: {np.abs(results['sklearn'] - results['compiled']).max():.2e}")
+
+
+if __name__ == "__main__":
+    import joblib
+
+    if not CompiledForest.exists() or CompiledForest().is_stale():
+        print("Compiling the random forest")
+        CompiledForest.compile(joblib.load(MODEL_FILE), source=MODEL_FILE)
+    print(CompiledForest().report())
+    benchmark()
@@ -1,15 +1,19 @@
-import os
 import sys
+import time
+import asyncio
 import logging
-import json
-from typing import List, Optional
+import threading
+import statistics
+from collections import deque
+from typing import Dict, Optional
 from twilio.rest import Client
 from dotenv import load_dotenv
 import chromadb
 from agents.planning_agent import PlanningAgent
 from agents.deals import Opportunity
-from sklearn.manifold import TSNE
-import numpy as np
+from projection_cache import ProjectionCache
+from opportunity_store import OpportunityStore
+from agents.startup import StartupProfile
 
 
 # Colors for logging
@@ -37,63 +41,156 @@ def init_logging():
 class DealAgentFramework:
 
     DB = "products_vectorstore"
-    MEMORY_FILENAME = "memory.json"
+    MEMORY_FILENAME = "memory.db"
+    # Scheduled runs are spaced out so the framework spends at most this fraction of its time running
+    RUN_DUTY_CYCLE = 0.5
+    MAX_RUN_INTERVAL = 3600
+    RECENT_RUNS = 5
 
-    def __init__(self):
+    def __init__(self, preload: bool = True):
+        """
+        Set up the framework
+        :param preload: start loading the agents' models in the background now, rather than on the first run
+        """
         init_logging()
         load_dotenv()
-        client = chromadb.PersistentClient(path=self.DB)
-        self.memory = self.read_memory()
+        self.profile = StartupProfile()
+        client = self.profile.timed("Chroma", lambda: chromadb.PersistentClient(path=self.DB))
+        self.memory = self.profile.timed("Memory", lambda: OpportunityStore(self.MEMORY_FILENAME))
         self.collection = client.get_or_create_collection('products')
         self.planner = None
+        self.run_lock = threading.Lock()
+        self.in_flight: Optional[asyncio.Task] = None
+        self.waiters: Dict[asyncio.Task, int] = {}
+        self.durations = deque(maxlen=self.RECENT_RUNS)
+        self.last_finished: Optional[float] = None
+        if preload:
+            self.init_agents_as_needed()
 
     def init_agents_as_needed(self):
         if not self.planner:
             self.log("Initializing Agent Framework")
-            self.planner = PlanningAgent(self.collection)
-            self.log("Agent Framework is ready")
+            self.planner = PlanningAgent(self.collection, self.profile)
+            self.profile.seal(lambda report: self.log(f"Agent Framework is {report}"))
+            self.log("Agent Framework is ready - models are loading in the background")
         
-    def read_memory(self) -> List[Opportunity]:
-        if os.path.exists(self.MEMORY_FILENAME):
-            with open(self.MEMORY_FILENAME, "r") as file:
-                data = json.load(file)
-            opportunities = [Opportunity(**item) for item in data]
-            return opportunities
-        return []
-
-    def write_memory(self) -> None:
-        data = [opportunity.dict() for opportunity in self.memory]
-        with open(self.MEMORY_FILENAME, "w") as file:
-            json.dump(data, file, indent=2)
-
     def log(self, message: str):
         text = BG_BLUE + WHITE + "[Agent Framework] " + message + RESET
         logging.info(text)
 
-    def run(self) -> List[Opportunity]:
-        self.init_agents_as_needed()
-        logging.info("Kicking off Planning Agent")
-        result = self.planner.plan(memory=self.memory)
-        logging.info(f"Planning Agent has completed and returned: {result}")
-        if result:
-            self.memory.append(result)
-            self.write_memory()
+    def remember(self, opportunity: Opportunity) -> None:
+        """
+        Add an opportunity to memory as soon as it's alerted, so it's never alerted again
+        """
+        self.memory.add(opportunity)
+
+    def next_interval(self, base: float) -> float:
+        """
+        How many seconds a UI timer should wait before the next scheduled run: the base interval,
+        stretched when recent runs have been slow enough to take up more than RUN_DUTY_CYCLE of it
+        """
+        if not self.durations:
+            return base
+        return min(max(base, statistics.median(self.durations) / self.RUN_DUTY_CYCLE), self.MAX_RUN_INTERVAL)
+
+    def ran_recently(self, base: float) -> bool:
+        """
+        True if a run finished less than half an interval ago, as when another browser session's timer has just fired
+        """
+        return self.last_finished is not None and time.monotonic() - self.last_finished < self.next_interval(base) / 2
+
+    def finished(self, started: float) -> None:
+        self.last_finished = time.monotonic()
+        self.durations.append(self.last_finished - started)
+        self.log(f"Run took {self.last_finished - started:.1f} seconds")
+
+    def run(self, interval: Optional[float] = None) -> OpportunityStore:
+        """
+        Run the planner once. Only one run happens at a time: if one is already in progress,
+        on another thread or on the event loop, this waits for it and returns its results instead of starting another
+        :param interval: for runs on a timer, the timer's interval; the run is skipped if another finished recently
+        """
+        if not self.run_lock.acquire(blocking=False):
+            self.log("A run is already in progress; waiting for it to finish")
+            with self.run_lock:
+                return self.memory
+        try:
+            if interval and self.ran_recently(interval):
+                self.log("Skipping this run, as the last one finished recently")
+                return self.memory
+            started = time.monotonic()
+            try:
+                self.init_agents_as_needed()
+                logging.info("Kicking off Planning Agent")
+                result = self.planner.plan(memory=self.memory, on_surfaced=self.remember)
+                logging.info(f"Planning Agent has completed and returned: {result}")
+            finally:
+                self.finished(started)
+            return self.memory
+        finally:
+            self.run_lock.release()
+
+    async def run_async(self, interval: Optional[float] = None) -> OpportunityStore:
+        """
+        Like run, but on the event loop. A caller that arrives while a run is in progress joins it,
+        and gets the same results when it's done. If every caller waiting on a run is cancelled,
+        as when all the pages watching it have closed, the run is cancelled too
+        :param interval: for runs on a timer, the timer's interval; the run is skipped if another finished recently
+        """
+        if self.in_flight is None or self.in_flight.done():
+            self.in_flight = asyncio.create_task(self.run_once_async(interval))
+            self.waiters[self.in_flight] = 0
+        else:
+            self.log("A run is already in progress; joining it")
+        run = self.in_flight
+        self.waiters[run] += 1
+        try:
+            await asyncio.shield(run)
+        finally:
+            self.waiters[run] -= 1
+            if not self.waiters[run]:
+                del self.waiters[run]
+                run.cancel()
         return self.memory
 
+    async def run_once_async(self, interval: Optional[float]) -> None:
+        if not self.run_lock.acquire(blocking=False):
+            self.log("A run is already in progress on another thread; waiting for it to finish")
+            await asyncio.to_thread(self.wait_for_run)
+            return
+        try:
+            if interval and self.ran_recently(interval):
+                self.log("Skipping this run, as the last one finished recently")
+                return
+            started = time.monotonic()
+            try:
+                # Loading the agents the first time happens on a worker thread
+                await asyncio.to_thread(self.init_agents_as_needed)
+                logging.info("Kicking off Planning Agent")
+                result = await self.planner.plan_async(memory=self.memory, on_surfaced=self.remember)
+                logging.info(f"Planning Agent has completed and returned: {result}")
+            finally:
+                self.finished(started)
+        finally:
+            self.run_lock.release()
+
+    def wait_for_run(self) -> None:
+        with self.run_lock:
+            pass
+
     @classmethod
-    def get_plot_data(cls, max_datapoints=10000):
-        client = chromadb.PersistentClient(path=cls.DB)
-        collection = client.get_or_create_collection('products')
-        result = collection.get(include=['embeddings', 'documents', 'metadatas'], limit=max_datapoints)
-        vectors = np.array(result['embeddings'])
-        documents = result['documents']
-        categories = [metadata['category'] for metadata in result['metadatas']]
+    def get_plot_data(cls, max_datapoints=10000, collection=None):
+        if collection is None:
+            client = chromadb.PersistentClient(path=cls.DB)
+            collection = client.get_or_create_collection('products')
+        documents, reduced_vectors, categories = ProjectionCache().projection(collection, max_datapoints)
         colors = [COLORS[CATEGORIES.index(c)] for c in categories]
-        tsne = TSNE(n_components=3, random_state=42, n_jobs=-1)
-        reduced_vectors = tsne.fit_transform(vectors)
         return documents, reduced_vectors, colors
 
 
 if __name__=="__main__":
-    DealAgentFramework().run()
+    if "--async" in sys.argv:
+        asyncio.run(DealAgentFramework().run_async())
+    else:
+        DealAgentFramework().run()
     
\ No newline at end of file
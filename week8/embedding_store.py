@@ -0,0 +1,196 @@
+import os
+import json
+from typing import List, Optional, Iterator, Tuple
+import numpy as np
+
+DB = "products_vectorstore"
+STORE_DIR = os.path.join(DB, "quantized")
+BATCH_SIZE = 10000
+
+
+class QuantizedEmbeddingStore:
+    """
+    A compact copy of the embeddings in the Chroma products collection,
+    kept in memory-mapped .npy files so they can be loaded without copying.
+    Vectors are stored as float16, or as int8 with a scale per dimension,
+    and are only dequantized to float32 when they are read.
+    """
+
+    VECTORS = "vectors.npy"
+    SCALES = "scales.npy"
+    PRICES = "prices.npy"
+    CATEGORIES = "categories.npy"
+    IDS = "ids.json"
+    METADATA = "metadata.json"
+    DTYPES = ("float16", "int8")
+
+    def __init__(self, path: str = STORE_DIR):
+        """
+        Open an existing store; nothing is read into memory until it's needed
+        :param path: the directory the store was built into
+        """
+        self.path = path
+        with open(os.path.join(path, self.METADATA), "r") as file:
+            self.metadata = json.load(file)
+        self.dtype = self.metadata["dtype"]
+        self.raw = np.load(os.path.join(path, self.VECTORS), mmap_mode="r")
+        self.scales = np.load(os.path.join(path, self.SCALES)) if self.dtype == "int8" else None
+        self.prices = np.load(os.path.join(path, self.PRICES), mmap_mode="r")
+        self.category_codes = np.load(os.path.join(path, self.CATEGORIES), mmap_mode="r")
+        self._ids = None
+
+    @classmethod
+    def exists(cls, path: str = STORE_DIR) -> bool:
+        return os.path.exists(os.path.join(path, cls.METADATA))
+
+    @classmethod
+    def build(cls, collection, path: str = STORE_DIR, dtype: str = "int8", batch_size: int = BATCH_SIZE):
+        """
+        Stream every embedding out of the collection and write a quantized copy
+        Memory use is bounded by the batch size, not the size of the collection
+        :param collection: the Chroma collection to copy
+        :param path: the directory to write the store into
+        :param dtype: either float16, or int8 with per-dimension scales
+        :return: the newly built store
+        """
+        if dtype not in cls.DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype}, expected one of {cls.DTYPES}")
+        os.makedirs(path, exist_ok=True)
+        count = collection.count()
+        ids, categories = [], []
+        halfs = prices = None
+        for start in range(0, count, batch_size):
+            result = collection.get(include=['embeddings', 'metadatas'], limit=batch_size, offset=start)
+            batch = np.asarray(result['embeddings'], dtype=np.float32)
+            if halfs is None:
+                halfs = np.lib.format.open_memmap(os.path.join(path, "vectors.f16.tmp"), mode="w+", dtype=np.float16, shape=(count, batch.shape[1]))
+                prices = np.lib.format.open_memmap(os.path.join(path, cls.PRICES), mode="w+", dtype=np.float32, shape=(count,))
+            stop = start + len(batch)
+            halfs[start:stop] = batch
+            prices[start:stop] = [metadata['price'] for metadata in result['metadatas']]
+            categories.extend(metadata['category'] for metadata in result['metadatas'])
+            ids.extend(result['ids'])
+        if halfs is None:
+            raise ValueError("Cannot build an embedding store from an empty collection")
+        halfs.flush()
+        prices.flush()
+        dimensions = halfs.shape[1]
+
+        if dtype == "int8":
+            scales = np.zeros(halfs.shape[1], dtype=np.float32)
+            for start in range(0, count, batch_size):
+                scales = np.maximum(scales, np.abs(halfs[start:start + batch_size]).max(axis=0))
+            scales = np.where(scales > 0, scales / 127.0, 1.0).astype(np.float32)
+            np.save(os.path.join(path, cls.SCALES), scales)
+            codes = np.lib.format.open_memmap(os.path.join(path, cls.VECTORS), mode="w+", dtype=np.int8, shape=halfs.shape)
+            for start in range(0, count, batch_size):
+                chunk = halfs[start:start + batch_size].astype(np.float32) / scales
+                codes[start:start + batch_size] = np.clip(np.rint(chunk), -127, 127)
+            codes.flush()
+            del codes, halfs
+            os.remove(os.path.join(path, "vectors.f16.tmp"))
+        else:
+            del halfs
+            os.replace(os.path.join(path, "vectors.f16.tmp"), os.path.join(path, cls.VECTORS))
+
+        names = sorted(set(categories))
+        lookup = {name: code for code, name in enumerate(names)}
+        np.save(os.path.join(path, cls.CATEGORIES), np.array([lookup[c] for c in categories], dtype=np.uint8))
+        with open(os.path.join(path, cls.IDS), "w") as file:
+            json.dump(ids, file)
+        with open(os.path.join(path, cls.METADATA), "w") as file:
+            json.dump({"dtype": dtype, "count": count, "dimensions": dimensions, "categories": names}, file, indent=2)
+        return cls(path)
+
+    def __len__(self) -> int:
+        return self.raw.shape[0]
+
+    @property
+    def ids(self) -> List[str]:
+        if self._ids is None:
+            with open(os.path.join(self.path, self.IDS), "r") as file:
+                self._ids = json.load(file)
+        return self._ids
+
+    def categories(self, start: int = 0, stop: Optional[int] = None) -> List[str]:
+        names = self.metadata["categories"]
+        return [names[code] for code in self.category_codes[start:stop]]
+
+    def dequantize(self, raw: np.ndarray) -> np.ndarray:
+        vectors = raw.astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales
+        return vectors
+
+    def vectors(self, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """
+        Return a float32 copy of a slice of the vectors; only this slice is read from disk
+        """
+        return self.dequantize(self.raw[start:stop])
+
+    def iter_batches(self, batch_size: int = BATCH_SIZE) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Yield (vectors, prices) in batches, for training without holding every vector in memory
+        """
+        for start in range(0, len(self), batch_size):
+            yield self.vectors(start, start + batch_size), np.asarray(self.prices[start:start + batch_size])
+
+    def search(self, query: np.ndarray, k: int = 5, batch_size: int = BATCH_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exact nearest neighbour search by squared L2 distance (Chroma's default) over the quantized vectors
+        :param query: an array of query vectors, shape (queries, dimensions)
+        :param k: the number of neighbours to return for each query
+        :return: the row indices and distances of the k nearest vectors for each query
+        """
+        query = np.atleast_2d(np.asarray(query, dtype=np.float32))
+        best_rows = np.empty((len(query), 0), dtype=np.int64)
+        best_distances = np.empty((len(query), 0), dtype=np.float32)
+        query_norms = (query ** 2).sum(axis=1, keepdims=True)
+        for start in range(0, len(self), batch_size):
+            chunk = self.vectors(start, start + batch_size)
+            distances = query_norms - 2 * query @ chunk.T + (chunk ** 2).sum(axis=1)
+            rows = np.broadcast_to(np.arange(start, start + len(chunk)), distances.shape)
+            distances = np.concatenate([best_distances, distances], axis=1)
+            rows = np.concatenate([best_rows, rows], axis=1)
+            keep = np.argsort(distances, axis=1)[:, :k]
+            best_distances = np.take_along_axis(distances, keep, axis=1)
+            best_rows = np.take_along_axis(rows, keep, axis=1)
+        return best_rows, best_distances
+
+    def recall(self, collection, query: np.ndarray, k: int = 5) -> float:
+        """
+        Measure the effect of quantization on the RAG lookup in FrontierAgent.find_similars:
+        the fraction of the k products Chroma returns that the quantized store also returns
+        :param collection: the Chroma collection the store was built from
+        :param query: an array of encoded product descriptions
+        :return: the mean recall@k across the queries
+        """
+        query = np.atleast_2d(np.asarray(query, dtype=np.float32))
+        expected = collection.query(query_embeddings=query.astype(float).tolist(), n_results=k)['ids']
+        rows, _ = self.search(query, k=k)
+        ids = self.ids
+        hits = [len(set(chroma_ids) & {ids[row] for row in found}) / k for chroma_ids, found in zip(expected, rows)]
+        return float(np.mean(hits))
+
+    def report(self) -> str:
+        """
+        Describe the size of this store compared to the float64 vectors it replaces
+        """
+        stored = self.raw.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+        original = self.raw.size * 8
+        return f"{len(self):,} vectors stored as {self.dtype}: {stored/1e6:,.1f} MB vs {original/1e6:,.1f} MB as float64 ({original/stored:.1f}x smaller)"
+
+
+if __name__ == "__main__":
+    import sys
+    import chromadb
+    from sentence_transformers import SentenceTransformer
+
+    dtype = sys.argv[1] if len(sys.argv) > 1 else "int8"
+    client = chromadb.PersistentClient(path=DB)
+    collection = client.get_or_create_collection('products')
+    store = QuantizedEmbeddingStore.build(collection, dtype=dtype)
+    print(store.report())
+    sample = collection.get(limit=100, offset=len(store) // 2)['documents']
+    encoder = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+    print(f"Recall@5 against Chroma for find_similars: {store.recall(collection, encoder.encode(sample)):.3f}")
@@ -1,10 +1,14 @@
 import time
-import modal
 from datetime import datetime
+from agents.pricer_backends import ModalBackend
+from agents.pricer_warmer import PricerWarmer
 
-Pricer = modal.Cls.lookup("pricer-service", "Pricer")
-pricer = Pricer()
+# Pings the deployed pricer whenever it has been idle for longer than the threshold,
+# backing off after failures, and reports cold start vs warm latency as it goes
+
+warmer = PricerWarmer(ModalBackend(), idle_threshold=30)
 while True:
-    reply = pricer.wake_up.remote()
-    print(f"{datetime.now()}: {reply}")
-    time.sleep(30)
\ No newline at end of file
+    latency = warmer.check()
+    if latency is not None:
+        print(f"{datetime.now()}: pinged in {latency:.2f}s - {warmer.summary()}")
+    time.sleep(warmer.backoff())
@@ -1,21 +1,27 @@
 import modal
 from modal import App, Volume, Image
+from model_provisioning import MODELS_DIR, LoadTimings, models_volume, provision, preload
 
 # Setup
 
 app = modal.App("llama")
 image = Image.debian_slim().pip_install("torch", "transformers", "bitsandbytes", "accelerate")
 secrets = [modal.Secret.from_name("hf-secret")]
+mounts = [modal.Mount.from_local_python_packages("model_provisioning")]
+volume = models_volume()
 GPU = "T4"
 MODEL_NAME = "meta-llama/Meta-Llama-3.1-8B" # "google/gemma-2-2b"
 
+# The model and tokenizer stay loaded between calls on the same container
+loaded = {}
 
 
-@app.function(image=image, secrets=secrets, gpu=GPU, timeout=1800)
-def generate(prompt: str) -> str:
-    import os
+def load():
     import torch
-    from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, set_seed
+    from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+
+    timings = LoadTimings()
+    path = provision(MODEL_NAME, volume=volume, timings=timings)
 
     # Quant Config
     quant_config = BitsAndBytesConfig(
@@ -26,17 +32,31 @@ def generate(prompt: str) -> str:
     )
 
     # Load model and tokenizer
-    
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+
+    tokenizer = AutoTokenizer.from_pretrained(path)
     tokenizer.pad_token = tokenizer.eos_token
     tokenizer.padding_side = "right"
-    
-    model = AutoModelForCausalLM.from_pretrained(
-        MODEL_NAME, 
-        quantization_config=quant_config,
-        device_map="auto"
-    )
 
+    with timings.stage("deserialize"):
+        preload(path)
+    with timings.stage("quantize"):
+        model = AutoModelForCausalLM.from_pretrained(
+            path,
+            quantization_config=quant_config,
+            device_map="auto"
+        )
+    print(timings.report())
+    loaded.update(tokenizer=tokenizer, model=model)
+
+
+@app.function(image=image, secrets=secrets, gpu=GPU, timeout=1800, mounts=mounts, volumes={MODELS_DIR: volume})
+def generate(prompt: str) -> str:
+    import torch
+    from transformers import set_seed
+
+    if not loaded:
+        load()
+    tokenizer, model = loaded["tokenizer"], loaded["model"]
     set_seed(42)
     inputs = tokenizer.encode(prompt, return_tensors="pt").to("cuda")
     attention_mask = torch.ones(inputs.shape, device="cuda")
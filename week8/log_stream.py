@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from collections import deque
+from typing import AsyncIterator, List
+
+# Lines arriving within this many seconds of each other are sent to the page together
+FRAME_SECONDS = 0.2
+# How many of the latest lines a page keeps and shows
+LOG_LINES = 18
+
+
+def log_buffer() -> deque:
+    """
+    A ring buffer holding the latest lines for a page, dropping the oldest as new ones arrive
+    """
+    return deque(maxlen=LOG_LINES)
+
+
+class LogStream(logging.Handler):
+    """
+    Streams log records to an asyncio consumer, such as a Gradio event handler.
+    Use it as a context manager for the duration of one run: it adds itself to the root logger
+    on entry and removes itself on exit, so each session has exactly one handler while it's listening.
+    Records can be logged from any thread; each one wakes the consumer through the event loop,
+    so nothing polls while the agents are quiet. A burst of records is delivered as a single batch.
+    """
+
+    def __init__(self, level: int = logging.INFO):
+        """
+        Create the stream; this must be called on the event loop that will consume it
+        """
+        super().__init__(level)
+        self.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S %z"))
+        self.loop = asyncio.get_running_loop()
+        self.pending = deque()
+        self.ready = asyncio.Event()
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.pending.append(self.format(record))
+            self.loop.call_soon_threadsafe(self.ready.set)
+        except RuntimeError:
+            # The event loop has closed, so there's nobody left to read this
+            pass
+        except Exception:
+            self.handleError(record)
+
+    def __enter__(self):
+        logger = logging.getLogger()
+        logger.addHandler(self)
+        logger.setLevel(logging.INFO)
+        return self
+
+    def __exit__(self, *exc_info):
+        logging.getLogger().removeHandler(self)
+        self.close()
+
+    def drain(self) -> List[str]:
+        """
+        Take every line that has arrived since the last call
+        """
+        lines = []
+        while self.pending:
+            lines.append(self.pending.popleft())
+        return lines
+
+    async def batches(self, until: asyncio.Future, frame: float = FRAME_SECONDS) -> AsyncIterator[List[str]]:
+        """
+        Yield the lines as they're logged, at most one batch per frame, until the future is done
+        and every line logged before then has been yielded
+        :param until: typically the task doing the work that's being logged
+        :param frame: how long to let lines gather after the first one arrives, before yielding them
+        """
+        while True:
+            waiter = asyncio.ensure_future(self.ready.wait())
+            await asyncio.wait({waiter, until}, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            self.ready.clear()
+            if not until.done():
+                await asyncio.sleep(frame)
+            lines = self.drain()
+            if lines:
+                yield lines
+            elif until.done():
+                return
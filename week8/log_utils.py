@@ -1,3 +1,8 @@
+import re
+import html
+import time
+from functools import lru_cache
+
 # Foreground colors
 RED = '\033[31m'
 GREEN = '\033[32m'
@@ -26,10 +31,78 @@ mapper = {
 }
 
 
+# What each color code, and the reset code, becomes in the page
+spans = {
+    **{code: f'<span style="color: {color}">' for code, color in mapper.items()},
+    RESET: '</span>',
+}
+
+
+# Every color code and the reset code, matched in one pass; the combined codes are listed first, so they match whole
+codes = re.compile('|'.join(re.escape(code) for code in sorted(spans, key=len, reverse=True)))
+
+
 def reformat(message):
-    for key, value in mapper.items():
-        message = message.replace(key, f'<span style="color: {value}">')
-    message = message.replace(RESET, '</span>')
-    return message
-    
-    
\ No newline at end of file
+    """
+    Convert a log line with ANSI color codes to HTML, in a single regex pass that looks each code up in spans.
+    The text is HTML-escaped first, so a deal description can't inject markup into the page;
+    the line only ever appears as the content of an element, so quotes are left alone.
+    The color codes contain nothing that escaping changes, so they're replaced afterwards
+    """
+    return codes.sub(lambda match: spans[match[0]], html.escape(message, quote=False))
+
+
+def benchmark(lines: int = 100000, repeats: int = 5):
+    """
+    Compare this converter with the one it replaced, which made a pass over the line for every color
+    and didn't escape the text; with that converter plus escaping, which is what this one does in a single pass;
+    and with a variant that caches the conversion of everything after the timestamp.
+    The cache only helps when the same message is logged again, so it's measured on lines that are all different,
+    and on lines where half the messages repeat, as the agents' fixed progress messages do
+    """
+    def legacy(message):
+        for key, value in mapper.items():
+            message = message.replace(key, f'<span style="color: {value}">')
+        return message.replace(RESET, '</span>')
+
+    def multi_pass(message):
+        message = html.escape(message, quote=False)
+        for code, span in spans.items():
+            message = message.replace(code, span)
+        return message
+
+    @lru_cache(maxsize=1024)
+    def after_timestamp(text):
+        return reformat(text)
+
+    def prefix_cached(message):
+        timestamp, separator, text = message.partition("] ")
+        return html.escape(timestamp, quote=False) + separator + after_timestamp(text)
+
+    def line(i, text):
+        return f"[2024-11-20 10:{i // 60 % 60:02d}:{i % 60:02d} +0000] {colors[i % len(colors)]}[Agent {i % 7}] {text}{RESET}"
+
+    colors = list(mapper)
+    unique = [line(i, f"Priced <deal> {i} at ${i % 500}.99 & counting") for i in range(lines)]
+    repeating = [line(i, f"Priced <deal> {i} at ${i % 500}.99 & counting" if i % 2 else f"is working on step {i % 20}")
+                 for i in range(lines)]
+    for corpus, messages in (("unique", unique), ("half repeating", repeating)):
+        rates = {}
+        for name, convert in (("legacy", legacy), ("multi-pass", multi_pass), ("reformat", reformat),
+                               ("prefix cached", prefix_cached)):
+            best = float("inf")
+            for _ in range(repeats):
+                after_timestamp.cache_clear()
+                start = time.perf_counter()
+                for message in messages:
+                    convert(message)
+                best = min(best, time.perf_counter() - start)
+            rates[name] = len(messages) / best
+            print(f"{corpus:16} {name:16} {rates[name]:12,.0f} lines/s  {rates[name] / rates['legacy']:.2f}x legacy")
+        # Escaping aside, the output is the same as the legacy converter's
+        assert all(reformat(message) == legacy(html.escape(message, quote=False)) for message in messages)
+        assert all(multi_pass(message) == prefix_cached(message) == reformat(message) for message in messages)
+
+
+if __name__ == "__main__":
+    benchmark()
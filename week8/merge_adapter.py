@@ -0,0 +1,41 @@
+import modal
+from modal import App, Image
+from pricer_model import GPU, BASE_MODEL, FINETUNED_MODEL, MERGED_MODEL, REVISION, PricerModel, merge_adapter, benchmark_merge
+from model_provisioning import MODELS_DIR, local_dir_for, models_volume, provision
+
+# An offline step: merge the LoRA adapter into the base model once, and save the result to the models volume.
+# The Pricer then loads the merged checkpoint directly, with no PEFT wrapper and no extra LoRA matmuls per forward pass.
+# Run with: modal run merge_adapter.py
+# Or, to also compare setup time and per-token latency before and after: modal run merge_adapter.py --compare
+
+app = modal.App("pricer-merge")
+image = Image.debian_slim().pip_install("huggingface", "torch", "transformers", "bitsandbytes", "accelerate", "peft")
+secrets = [modal.Secret.from_name("hf-secret")]
+mounts = [modal.Mount.from_local_python_packages("pricer_model", "model_provisioning")]
+volume = models_volume()
+
+
+# The merge runs on CPU in bfloat16: the 8B model needs about 16GB, more than a T4 has to spare
+
+@app.function(image=image, secrets=secrets, mounts=mounts, volumes={MODELS_DIR: volume}, memory=40960, timeout=3600)
+def merge() -> str:
+    base_model = provision(BASE_MODEL, volume=volume)
+    finetuned_model = provision(FINETUNED_MODEL, REVISION, volume=volume)
+    path = merge_adapter(base_model, finetuned_model, REVISION, local_dir_for(MERGED_MODEL, REVISION))
+    volume.commit()
+    return path
+
+
+@app.function(image=image, secrets=secrets, gpu=GPU, mounts=mounts, volumes={MODELS_DIR: volume}, timeout=1800)
+def benchmark():
+    descriptions = [f"Product number {i}: a usb condenser microphone with a {i} foot cable" for i in range(32)]
+    adapter = PricerModel.provisioned(volume)
+    merged = PricerModel.merged(volume)
+    benchmark_merge(adapter, merged, descriptions)
+
+
+@app.local_entrypoint()
+def main(compare: bool = False):
+    print(f"Merged model saved to {merge.remote()}")
+    if compare:
+        benchmark.remote()
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import hashlib
+import logging
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+# Model weights are downloaded once into a persistent Modal Volume mounted at MODELS_DIR,
+# and shared by every app and container that mounts it
+
+MODELS_DIR = "/models"
+VOLUME_NAME = "pricer-models"
+MANIFEST = "manifest.json"
+DOWNLOAD_WORKERS = 16
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def models_volume():
+    """
+    The persistent Modal Volume holding the model weights; pass it to an app as volumes={MODELS_DIR: models_volume()}
+    """
+    import modal
+    return modal.Volume.from_name(VOLUME_NAME, create_if_missing=True)
+
+
+class LoadTimings:
+    """
+    Records how long each stage of getting a model ready takes:
+    download, deserialize (reading the weights from disk), quantize (building the model on the GPU) and adapter
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def total(self) -> float:
+        return sum(self.stages.values())
+
+    def report(self) -> str:
+        parts = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in self.stages.items())
+        return f"Model ready in {self.total():.1f}s ({parts})"
+
+
+def sha256_of(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def local_dir_for(repo_id: str, revision: Optional[str] = None, root: str = MODELS_DIR) -> str:
+    return os.path.join(root, repo_id, revision or "main")
+
+
+def expected_checksums(repo_id: str, revision: Optional[str] = None) -> Dict[str, Optional[str]]:
+    """
+    Ask the Hugging Face Hub for the files in this revision, with the sha256 of each large (LFS) file
+    """
+    from huggingface_hub import HfApi
+    info = HfApi().model_info(repo_id, revision=revision, files_metadata=True)
+    return {sibling.rfilename: sibling.lfs.sha256 if sibling.lfs else None for sibling in info.siblings}
+
+
+def write_manifest(path: str, files: Dict[str, dict], **details) -> None:
+    """
+    Record the size and checksum of every file in a provisioned model, so verify can check it later
+    :param path: the model directory
+    :param files: a size and sha256 for each file name
+    :param details: anything else worth recording about where the model came from
+    """
+    with open(os.path.join(path, MANIFEST), "w") as file:
+        json.dump({**details, "files": files}, file, indent=2)
+
+
+def describe_files(path: str) -> Dict[str, dict]:
+    """
+    The size and checksum of every file in a directory, for a model written locally rather than downloaded
+    """
+    files = {}
+    for name in sorted(os.listdir(path)):
+        file_path = os.path.join(path, name)
+        if name != MANIFEST and os.path.isfile(file_path):
+            files[name] = {"size": os.path.getsize(file_path), "sha256": sha256_of(file_path)}
+    return files
+
+
+def verify(path: str, deep: bool = False) -> bool:
+    """
+    Check a provisioned model against its manifest
+    A quick check compares file sizes; a deep check recomputes every checksum
+    """
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path, "r") as file:
+        manifest = json.load(file)
+    for name, entry in manifest["files"].items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != entry["size"]:
+            return False
+        if deep and entry["sha256"] and sha256_of(file_path) != entry["sha256"]:
+            return False
+    return True
+
+
+def provision(repo_id: str, revision: Optional[str] = None, root: str = MODELS_DIR, volume=None,
+              timings: Optional[LoadTimings] = None) -> str:
+    """
+    Make sure this model is on the persistent volume, downloading it only if it isn't there yet
+    Files are downloaded in parallel to a temporary folder, checked against the Hub's checksums,
+    then moved into place, so a half-finished download is never mistaken for a complete one.
+    Each call downloads to a folder of its own, so containers that start cold together don't write
+    over each other; whichever finishes second finds the model in place and keeps that copy
+    :param repo_id: the model on the Hugging Face Hub
+    :param revision: the revision to download, or None for the latest
+    :param root: the directory the volume is mounted at
+    :param volume: the Modal Volume, to reload before checking and commit after downloading
+    :param timings: if provided, the download time is recorded here
+    :return: the local directory holding the model
+    """
+    from huggingface_hub import snapshot_download
+
+    path = local_dir_for(repo_id, revision, root)
+    if volume is not None:
+        volume.reload()
+    if verify(path):
+        return path
+    timings = timings or LoadTimings()
+    with timings.stage("download"):
+        logging.info(f"Downloading {repo_id} to {path}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".partial-")
+        try:
+            snapshot_download(repo_id, revision=revision, local_dir=temp, max_workers=DOWNLOAD_WORKERS,
+                              ignore_patterns=["*.pth", "original/*"])
+            checksums = expected_checksums(repo_id, revision)
+            files = {}
+            for name, expected in checksums.items():
+                file_path = os.path.join(temp, name)
+                if not os.path.exists(file_path):
+                    continue
+                actual = sha256_of(file_path) if expected else None
+                if expected and actual != expected:
+                    raise ValueError(f"Checksum mismatch for {repo_id}/{name}: expected {expected}, got {actual}")
+                files[name] = {"size": os.path.getsize(file_path), "sha256": actual}
+            write_manifest(temp, files, repo_id=repo_id, revision=revision)
+            if verify(path):
+                logging.info(f"{repo_id} was put in place by another container while this one was downloading it")
+                return path
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            try:
+                os.replace(temp, path)
+            except OSError:
+                # Another container moved its copy into place between the check and the move
+                if not verify(path):
+                    raise
+                logging.info(f"{repo_id} was put in place by another container while this one was downloading it")
+                return path
+        finally:
+            shutil.rmtree(temp, ignore_errors=True)
+        if volume is not None:
+            volume.commit()
+    return path
+
+
+def preload(path: str, workers: int = 8) -> int:
+    """
+    Read the safetensors files of a model once, in parallel, so the pages are in the OS cache
+    when from_pretrained memory-maps them; this turns many small random reads from the volume
+    into a few large sequential ones
+    :return: the number of bytes read
+    """
+    files = [os.path.join(path, name) for name in os.listdir(path) if name.endswith(".safetensors")]
+
+    def read(file_path):
+        total = 0
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+                total += len(chunk)
+        return total
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(read, files))
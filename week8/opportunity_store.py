@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+from agents.deals import Opportunity, Deal
+
+STORE_FILE = "memory.db"
+LEGACY_FILE = "memory.json"
+PAGE_SIZE = 20
+
+
+def opportunity_from(row) -> Opportunity:
+    description, price, url, estimate, discount = row
+    deal = Deal(product_description=description, price=price, url=url)
+    return Opportunity(deal=deal, estimate=estimate, discount=discount)
+
+
+class OpportunityStore:
+    """
+    The framework's memory of every opportunity it has surfaced, kept in SQLite.
+    Opening it doesn't read the opportunities, and remembering one is a single indexed insert
+    in its own transaction, so neither cost grows with the size of the memory.
+    The URL is unique, which gives the scanner an indexed check for deals it has seen before,
+    and means the same deal can never be remembered twice.
+    A new store imports the opportunities from the old memory.json, if there is one.
+    It behaves like the list of opportunities it replaces: it has a length, can be indexed
+    in the order the opportunities were found, and can be iterated over.
+    """
+
+    COLUMNS = "product_description, price, url, estimate, discount"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS opportunities (
+            id INTEGER PRIMARY KEY,
+            product_description TEXT NOT NULL,
+            price REAL NOT NULL,
+            url TEXT NOT NULL UNIQUE,
+            estimate REAL NOT NULL,
+            discount REAL NOT NULL,
+            found_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS opportunities_by_discount ON opportunities (discount);
+    """
+    # How a page of opportunities can be sorted; both orders are served by an index
+    ORDERS = {
+        "discount": "discount DESC, id DESC",
+        "recent": "id DESC",
+    }
+
+    def __init__(self, path: str = STORE_FILE, legacy_file: Optional[str] = LEGACY_FILE):
+        """
+        Open the store, creating it if needed
+        :param path: the SQLite database file, or ":memory:"
+        :param legacy_file: a memory.json to import from when the database is first created
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        is_new = path == ":memory:" or not os.path.exists(path)
+        # The framework remembers opportunities from worker threads, and the UI reads them from others
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+        if is_new and legacy_file and os.path.exists(legacy_file):
+            self.import_json(legacy_file)
+
+    def import_json(self, filename: str) -> int:
+        """
+        Add the opportunities in a memory.json file written by earlier versions of the framework
+        :return: the number of opportunities that weren't already in the store
+        """
+        with open(filename, "r") as file:
+            data = json.load(file)
+        return self.add_all(Opportunity(**item) for item in data)
+
+    def add(self, opportunity: Opportunity) -> bool:
+        """
+        Remember an opportunity, committing it to disk straight away
+        :return: True if it was added, False if an opportunity with the same URL was already remembered
+        """
+        return self.add_all([opportunity]) == 1
+
+    def add_all(self, opportunities: Iterable[Opportunity]) -> int:
+        """
+        Remember several opportunities in one transaction
+        :return: how many were added
+        """
+        now = time.time()
+        rows = [(opp.deal.product_description, opp.deal.price, opp.deal.url, opp.estimate, opp.discount, now)
+                for opp in opportunities]
+        with self.lock:
+            before = self.connection.total_changes
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.executemany(
+                    f"INSERT OR IGNORE INTO opportunities ({self.COLUMNS}, found_at) VALUES (?, ?, ?, ?, ?, ?)", rows)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            return self.connection.total_changes - before
+
+    def query(self, sql: str, parameters=()) -> List[tuple]:
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def __contains__(self, url: str) -> bool:
+        """
+        True if a deal with this URL has been surfaced before
+        """
+        return bool(self.query("SELECT 1 FROM opportunities WHERE url = ?", (url,)))
+
+    def known_urls(self, urls: Iterable[str]) -> Set[str]:
+        """
+        The URLs from this list that have been surfaced before, looked up in one query
+        """
+        urls = list(urls)
+        if not urls:
+            return set()
+        placeholders = ", ".join("?" * len(urls))
+        return {row[0] for row in self.query(f"SELECT url FROM opportunities WHERE url IN ({placeholders})", urls)}
+
+    @staticmethod
+    def where(search: Optional[str] = None, min_discount: Optional[float] = None) -> Tuple[str, list]:
+        """
+        The WHERE clause and its parameters for the filters shared by page and count
+        """
+        conditions, parameters = [], []
+        if search:
+            escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            conditions.append("(product_description LIKE ? ESCAPE '\\' OR url LIKE ? ESCAPE '\\')")
+            parameters += [f"%{escaped}%"] * 2
+        if min_discount is not None:
+            conditions.append("discount >= ?")
+            parameters.append(min_discount)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), parameters
+
+    def page(self, number: int = 0, size: int = PAGE_SIZE, order: str = "discount",
+             search: Optional[str] = None, min_discount: Optional[float] = None) -> List[Opportunity]:
+        """
+        One page of opportunities, filtered and sorted by the database, so the cost of showing
+        a page depends on its size rather than on how many opportunities have been remembered
+        :param number: which page, counting from 0
+        :param size: opportunities per page
+        :param order: "discount" for the biggest discounts first, or "recent" for the latest first
+        :param search: only opportunities whose description or URL contains this text, ignoring case
+        :param min_discount: only opportunities with at least this discount
+        """
+        where, parameters = self.where(search, min_discount)
+        sql = f"SELECT {self.COLUMNS} FROM opportunities{where} ORDER BY {self.ORDERS[order]} LIMIT ? OFFSET ?"
+        return [opportunity_from(row) for row in self.query(sql, parameters + [size, number * size])]
+
+    def count(self, search: Optional[str] = None, min_discount: Optional[float] = None) -> int:
+        """
+        How many opportunities pass the filters
+        """
+        where, parameters = self.where(search, min_discount)
+        return self.query(f"SELECT COUNT(*) FROM opportunities{where}", parameters)[0][0]
+
+    def last_id(self) -> int:
+        """
+        The id of the most recently remembered opportunity, 0 if there are none;
+        it changes exactly when something is remembered, so callers can cheaply tell if they're up to date
+        """
+        return self.query("SELECT COALESCE(MAX(id), 0) FROM opportunities")[0][0]
+
+    def __len__(self) -> int:
+        return self.query("SELECT COUNT(*) FROM opportunities")[0][0]
+
+    def __getitem__(self, index: int) -> Opportunity:
+        """
+        The opportunity at this position in the order they were found; negative indexes count from the end
+        """
+        order = "ASC"
+        if index < 0:
+            index, order = -index - 1, "DESC"
+        rows = self.query(f"SELECT {self.COLUMNS} FROM opportunities ORDER BY id {order} LIMIT 1 OFFSET ?", (index,))
+        if not rows:
+            raise IndexError("opportunity index out of range")
+        return opportunity_from(rows[0])
+
+    def __iter__(self) -> Iterator[Opportunity]:
+        return iter([opportunity_from(row) for row in self.query(f"SELECT {self.COLUMNS} FROM opportunities ORDER BY id")])
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -1,11 +1,24 @@
+import threading
 import gradio as gr
 from deal_agent_framework import DealAgentFramework
 from agents.deals import Opportunity, Deal
+from opportunity_store import PAGE_SIZE
+
+# Seconds between runs, unless runs are taking long enough that the framework stretches it
+RUN_INTERVAL = 60
 
 class App:
 
     def __init__(self):    
         self.agent_framework = None
+        self.framework_lock = threading.Lock()
+
+    def get_agent_framework(self):
+        # Sessions share one framework, so runs from every browser session are serialized by its run lock
+        with self.framework_lock:
+            if not self.agent_framework:
+                self.agent_framework = DealAgentFramework()
+        return self.agent_framework
 
     def run(self):
         with gr.Blocks(title="The Price is Right", fill_width=True) as ui:
@@ -14,22 +27,23 @@ class App:
                 return [[opp.deal.product_description, f"${opp.deal.price:.2f}", f"${opp.estimate:.2f}", f"${opp.discount:.2f}", opp.deal.url] for opp in opps]
         
             def start():
-                self.agent_framework = DealAgentFramework()
-                opportunities = self.agent_framework.memory
+                opportunities = self.get_agent_framework().memory.page(size=PAGE_SIZE)
                 table = table_for(opportunities)
                 return table
         
             def go():
-                self.agent_framework.run()
-                new_opportunities = self.agent_framework.memory
+                agent_framework = self.get_agent_framework()
+                agent_framework.run(interval=RUN_INTERVAL)
+                new_opportunities = agent_framework.memory.page(size=PAGE_SIZE)
                 table = table_for(new_opportunities)
-                return table
+                return table, gr.update(value=agent_framework.next_interval(RUN_INTERVAL))
         
             def do_select(selected_index: gr.SelectData):
-                opportunities = self.agent_framework.memory
+                agent_framework = self.get_agent_framework()
+                opportunities = agent_framework.memory.page(size=PAGE_SIZE)
                 row = selected_index.index[0]
                 opportunity = opportunities[row]
-                self.agent_framework.planner.messenger.alert(opportunity)
+                agent_framework.planner.messenger.alert(opportunity, immediately=True)
         
             with gr.Row():
                 gr.Markdown('<div style="text-align: center;font-size:24px">"The Price is Right" - Deal Hunting Agentic AI</div>')
@@ -49,8 +63,8 @@ class App:
         
             ui.load(start, inputs=[], outputs=[opportunities_dataframe])
 
-            timer = gr.Timer(value=60)
-            timer.tick(go, inputs=[], outputs=[opportunities_dataframe])
+            timer = gr.Timer(value=RUN_INTERVAL)
+            timer.tick(go, inputs=[], outputs=[opportunities_dataframe, timer])
 
             opportunities_dataframe.select(do_select)
         
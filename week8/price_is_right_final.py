@@ -1,76 +1,80 @@
-import logging
-import queue
+import asyncio
 import threading
-import time
 import gradio as gr
 from deal_agent_framework import DealAgentFramework
 from agents.deals import Opportunity, Deal
 from log_utils import reformat
+from log_stream import LogStream, log_buffer
+from opportunity_store import PAGE_SIZE
 import plotly.graph_objects as go
 
+# The ways the deals table can be sorted, and the order each asks the store for
+SORT_ORDERS = {"Biggest discount": "discount", "Most recent": "recent"}
+# Seconds between runs, unless runs are taking long enough that the framework stretches it
+RUN_INTERVAL = 300
 
-class QueueHandler(logging.Handler):
-    def __init__(self, log_queue):
-        super().__init__()
-        self.log_queue = log_queue
-
-    def emit(self, record):
-        self.log_queue.put(self.format(record))
 
 def html_for(log_data):
-    output = '<br>'.join(log_data[-18:])
+    output = '<br>'.join(log_data)
     return f"""
     <div id="scrollContent" style="height: 400px; overflow-y: auto; border: 1px solid #ccc; background-color: #222229; padding: 10px;">
     {output}
     </div>
     """
 
-def setup_logging(log_queue):
-    handler = QueueHandler(log_queue)
-    formatter = logging.Formatter(
-        "[%(asctime)s] %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S %z",
-    )
-    handler.setFormatter(formatter)
-    logger = logging.getLogger()
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
-                
 
 class App:
 
     def __init__(self):    
         self.agent_framework = None
+        self.framework_lock = threading.Lock()
 
     def get_agent_framework(self):
-        if not self.agent_framework:
-            self.agent_framework = DealAgentFramework()
+        # Sessions share one framework, and Gradio calls this from its worker threads as well as its event loop
+        with self.framework_lock:
+            if not self.agent_framework:
+                self.agent_framework = DealAgentFramework()
         return self.agent_framework
 
     def run(self):
         with gr.Blocks(title="The Price is Right", fill_width=True) as ui:
             
-            log_data = gr.State([])
+            log_data = gr.State(log_buffer())
             
             def table_for(opps):
                 return [[opp.deal.product_description, f"${opp.deal.price:.2f}", f"${opp.estimate:.2f}", f"${opp.discount:.2f}", opp.deal.url] for opp in opps]
 
-            def update_output(log_data, log_queue, result_queue):
-                initial_result = table_for(self.get_agent_framework().memory)
-                final_result = None
-                while True:
-                    try:
-                        message = log_queue.get_nowait()
-                        log_data.append(reformat(message))
-                        yield log_data, html_for(log_data), final_result or initial_result
-                    except queue.Empty:
-                        try:
-                            final_result = result_queue.get_nowait()
-                            yield log_data, html_for(log_data), final_result or initial_result
-                        except queue.Empty:
-                            if final_result is not None:
-                                break
-                            time.sleep(0.1)
+            def page_of(search, sort, min_discount, page):
+                """
+                The opportunities on the page being viewed, queried from the memory store
+                """
+                return self.get_agent_framework().memory.page(
+                    number=max(int(page or 1), 1) - 1,
+                    size=PAGE_SIZE,
+                    order=SORT_ORDERS[sort],
+                    search=search.strip() or None,
+                    min_discount=min_discount or None,
+                )
+
+            def show_page(search, sort, min_discount, page):
+                """
+                The deals table for the page being viewed, with a line saying where it is in the results
+                """
+                memory = self.get_agent_framework().memory
+                total = memory.count(search=search.strip() or None, min_discount=min_discount or None)
+                start = (max(int(page or 1), 1) - 1) * PAGE_SIZE
+                opportunities = page_of(search, sort, min_discount, page)
+                if opportunities:
+                    status = f"Showing {start + 1:,}-{start + len(opportunities):,} of {total:,} deals"
+                else:
+                    status = f"No deals on this page; {total:,} in total"
+                return table_for(opportunities), status
+
+            def first_page(search, sort, min_discount):
+                """
+                Go back to the first page when the filters or the sort order change
+                """
+                return *show_page(search, sort, min_discount, 1), 1
 
             def get_initial_plot():
                 fig = go.Figure()
@@ -81,7 +85,7 @@ class App:
                 return fig
 
             def get_plot():
-                documents, vectors, colors = DealAgentFramework.get_plot_data(max_datapoints=1000)
+                documents, vectors, colors = DealAgentFramework.get_plot_data(max_datapoints=1000, collection=self.get_agent_framework().collection)
                 # Create the 3D scatter plot
                 fig = go.Figure(data=[go.Scatter3d(
                     x=vectors[:, 0],
@@ -106,31 +110,43 @@ class App:
 
                 return fig
         
-            def do_run():
-                new_opportunities = self.get_agent_framework().run()
-                table = table_for(new_opportunities)
-                return table
-
-            def run_with_logging(initial_log_data):
-                log_queue = queue.Queue()
-                result_queue = queue.Queue()
-                setup_logging(log_queue)
-                
-                def worker():
-                    result = do_run()
-                    result_queue.put(result)
-                
-                thread = threading.Thread(target=worker)
-                thread.start()
-                
-                for log_data, output, final_result in update_output(initial_log_data, log_queue, result_queue):
-                    yield log_data, output, final_result
-
-            def do_select(selected_index: gr.SelectData):
-                opportunities = self.get_agent_framework().memory
+            async def run_with_logging(initial_log_data, search, sort, min_discount, page):
+                """
+                Run the agent framework as a task on Gradio's event loop, streaming its logs to the page
+                as they arrive, a batch at a time. If another session's run is in progress, this session joins it;
+                if it's just finished, there's no new run. If every page watching a run goes away, the run is cancelled.
+                The deals table is only queried and sent again when a deal has been remembered since it was last sent,
+                and at the end the timer is set to the next interval, which grows if runs are slow
+                """
+                log_data = initial_log_data
+                framework = self.get_agent_framework()
+                shown = None
+
+                def changes():
+                    nonlocal shown
+                    latest = framework.memory.last_id()
+                    if latest == shown:
+                        return gr.update(), gr.update()
+                    shown = latest
+                    return show_page(search, sort, min_discount, page)
+
+                with LogStream() as stream:
+                    run = asyncio.create_task(framework.run_async(interval=RUN_INTERVAL))
+                    try:
+                        async for lines in stream.batches(until=run):
+                            log_data.extend(reformat(line) for line in lines)
+                            yield log_data, html_for(log_data), *changes(), gr.update()
+                        run.result()
+                        yield log_data, html_for(log_data), *changes(), gr.update(value=framework.next_interval(RUN_INTERVAL))
+                    finally:
+                        if not run.done():
+                            run.cancel()
+
+            def do_select(search, sort, min_discount, page, selected_index: gr.SelectData):
+                opportunities = page_of(search, sort, min_discount, page)
                 row = selected_index.index[0]
                 opportunity = opportunities[row]
-                self.get_agent_framework().planner.messenger.alert(opportunity)
+                self.get_agent_framework().planner.messenger.alert(opportunity, immediately=True)
         
             with gr.Row():
                 gr.Markdown('<div style="text-align: center;font-size:24px"><strong>The Price is Right</strong> - Autonomous Agent Framework that hunts for deals</div>')
@@ -145,18 +161,32 @@ class App:
                     col_count=5,
                     max_height=400,
                 )
+            with gr.Row():
+                search = gr.Textbox(placeholder="Search descriptions and URLs", show_label=False, scale=3)
+                sort = gr.Radio(list(SORT_ORDERS), value="Biggest discount", show_label=False, scale=2)
+                min_discount = gr.Number(label="Minimum discount ($)", value=None, minimum=0, scale=1)
+                page = gr.Number(label="Page", value=1, minimum=1, precision=0, scale=1)
+            with gr.Row():
+                status = gr.Markdown()
             with gr.Row():
                 with gr.Column(scale=1):
                     logs = gr.HTML()
                 with gr.Column(scale=1):
                     plot = gr.Plot(value=get_plot(), show_label=False)
         
-            ui.load(run_with_logging, inputs=[log_data], outputs=[log_data, logs, opportunities_dataframe])
+            filters = [search, sort, min_discount, page]
+            timer = gr.Timer(value=RUN_INTERVAL, active=True)
+            run_outputs = [log_data, logs, opportunities_dataframe, status, timer]
+            ui.load(run_with_logging, inputs=[log_data, *filters], outputs=run_outputs)
+
+            timer.tick(run_with_logging, inputs=[log_data, *filters], outputs=run_outputs)
 
-            timer = gr.Timer(value=300, active=True)
-            timer.tick(run_with_logging, inputs=[log_data], outputs=[log_data, logs, opportunities_dataframe])
+            search.submit(first_page, inputs=filters[:3], outputs=[opportunities_dataframe, status, page])
+            sort.change(first_page, inputs=filters[:3], outputs=[opportunities_dataframe, status, page])
+            min_discount.submit(first_page, inputs=filters[:3], outputs=[opportunities_dataframe, status, page])
+            page.change(show_page, inputs=filters, outputs=[opportunities_dataframe, status])
 
-            opportunities_dataframe.select(do_select)
+            opportunities_dataframe.select(do_select, inputs=filters)
         
         ui.launch(share=False, inbrowser=True)
 
@@ -0,0 +1,512 @@
+import os
+import re
+import copy
+import shutil
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import List, Optional
+from model_provisioning import LoadTimings, describe_files, local_dir_for, preload, provision, verify, write_manifest
+
+# Constants shared by every way of serving the fine-tuned pricer
+
+GPU = "T4"
+BASE_MODEL = "meta-llama/Meta-Llama-3.1-8B"
+PROJECT_NAME = "pricer"
+HF_USER = "ed-donner" # your HF name here! Or use mine if you just want to reproduce my results.
+RUN_NAME = "2024-09-13_13.04.39"
+PROJECT_RUN_NAME = f"{PROJECT_NAME}-{RUN_NAME}"
+REVISION = "e8d637df551603dc86cd7a1598a8f44af4d7ae36"
+FINETUNED_MODEL = f"{HF_USER}/{PROJECT_RUN_NAME}"
+# Where merge_adapter.py writes the base model with the adapter at REVISION merged into its weights
+MERGED_MODEL = f"{FINETUNED_MODEL}-merged"
+
+# A tiny causal LM that runs on CPU, so the serving code can be exercised without a GPU or Modal
+LOCAL_MODEL = "sshleifer/tiny-gpt2"
+
+QUESTION = "How much does this cost to the nearest dollar?"
+PREFIX = "Price is $"
+# The fine-tuning data put a blank line after the question and before PREFIX (see Item.make_prompt in items.py),
+# so every service prompts that way; pricer_service.py and pricer_ephemeral.py used to send a single newline
+HEADER = f"{QUESTION}\n\n"
+
+
+class PricerModel:
+    """
+    The fine-tuned pricer: the 4-bit quantized base model with our LoRA adapter.
+    Loading is the expensive part, so an instance is loaded once and then
+    serves as many price requests as it's given.
+    Use PricerModel.local() for a CPU-only stand-in with the same code path.
+    """
+
+    DECODINGS = ("free", "numeric", "expected")
+
+    def __init__(self, base_model: str = BASE_MODEL, finetuned_model: Optional[str] = FINETUNED_MODEL,
+                 revision: Optional[str] = REVISION, quantize: bool = True, device: str = "cuda", decoding: str = "free",
+                 prefix_cache: bool = False):
+        """
+        :param base_model: the name or local directory of the base model
+        :param finetuned_model: the name or local directory of the LoRA adapter, or None to use the base model alone
+        :param revision: the revision of the adapter to load
+        :param quantize: whether to load the base model in 4 bits with bitsandbytes
+        :param device: the device to run on
+        :param decoding: free to parse whatever the model writes, numeric to constrain it to write a number,
+        or expected to compute the expected price from the distribution over the first number token
+        :param prefix_cache: whether to compute the keys and values of the constant prompt header once,
+        and reuse them for every request so that prefill only covers the description
+        """
+        if decoding not in self.DECODINGS:
+            raise ValueError(f"Unsupported decoding {decoding}, expected one of {self.DECODINGS}")
+        self.base_model_name = base_model
+        self.finetuned_model_name = finetuned_model
+        self.revision = revision
+        self.quantize = quantize
+        self.device = device
+        self.decoding = decoding
+        self.prefix_cache = prefix_cache
+        self.tokenizer = None
+        self.model = None
+        self.header_ids = None
+        self.header_cache = None
+        self.timings = LoadTimings()
+        self._number_tokens = None
+
+    @classmethod
+    def local(cls, model_name: str = LOCAL_MODEL, **kwargs):
+        """
+        Create a small, unquantized pricer on CPU with no adapter
+        """
+        return cls(base_model=model_name, finetuned_model=None, revision=None, quantize=False, device="cpu", **kwargs)
+
+    @classmethod
+    def provisioned(cls, volume=None, **kwargs):
+        """
+        Create the pricer from copies of the base model and adapter on the persistent models volume,
+        downloading them there first if this is the first time
+        :param volume: the Modal Volume mounted at model_provisioning.MODELS_DIR
+        """
+        timings = LoadTimings()
+        base_model = provision(BASE_MODEL, volume=volume, timings=timings)
+        finetuned_model = provision(FINETUNED_MODEL, REVISION, volume=volume, timings=timings)
+        pricer = cls(base_model=base_model, finetuned_model=finetuned_model, **kwargs)
+        pricer.timings = timings
+        return pricer
+
+    @classmethod
+    def merged(cls, volume=None, **kwargs):
+        """
+        Create the pricer from the merged checkpoint written by merge_adapter.py, which needs no PEFT wrapper,
+        falling back to the base model and adapter if the merged checkpoint hasn't been made yet
+        :param volume: the Modal Volume mounted at model_provisioning.MODELS_DIR
+        """
+        path = local_dir_for(MERGED_MODEL, REVISION)
+        if volume is not None:
+            volume.reload()
+        if not verify(path):
+            logging.warning(f"No merged model at {path}; loading the base model and adapter instead")
+            return cls.provisioned(volume, **kwargs)
+        return cls(base_model=path, finetuned_model=None, revision=None, **kwargs)
+
+    @property
+    def loaded(self) -> bool:
+        return self.model is not None
+
+    def load(self):
+        """
+        Load the tokenizer, base model and adapter; does nothing if already loaded
+        """
+        if self.loaded:
+            return self
+        import torch
+        from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.base_model_name)
+        self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = "left"
+
+        if os.path.isdir(self.base_model_name):
+            with self.timings.stage("deserialize"):
+                preload(self.base_model_name)
+
+        if self.quantize:
+            quant_config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_use_double_quant=True,
+                bnb_4bit_compute_dtype=torch.bfloat16,
+                bnb_4bit_quant_type="nf4"
+            )
+            with self.timings.stage("quantize"):
+                model = AutoModelForCausalLM.from_pretrained(self.base_model_name, quantization_config=quant_config, device_map="auto")
+        else:
+            with self.timings.stage("load"):
+                model = AutoModelForCausalLM.from_pretrained(self.base_model_name).to(self.device)
+
+        if self.finetuned_model_name:
+            from peft import PeftModel
+            with self.timings.stage("adapter"):
+                model = PeftModel.from_pretrained(model, self.finetuned_model_name, revision=self.revision)
+        model.eval()
+        self.model = model
+        if self.prefix_cache:
+            self.cache_header()
+        logging.info(self.timings.report())
+        return self
+
+    def cache_header(self):
+        """
+        Run the constant prompt header through the model once and keep its keys and values
+        """
+        import torch
+
+        self.header_ids = self.tokenizer(HEADER, return_tensors="pt").input_ids.to(self.device)
+        with torch.no_grad():
+            self.header_cache = self.model(self.header_ids, use_cache=True).past_key_values
+
+    @staticmethod
+    def prompt_for(description: str) -> str:
+        """
+        The prompt in the same format as the training data, as Item.test_prompt makes it
+        """
+        return f"{HEADER}{description}\n\n{PREFIX}"
+
+    def encode(self, descriptions: List[str]):
+        """
+        Tokenize a batch of prompts, returning the model inputs and any cached keys and values to start from.
+        Without the prefix cache, prompts are simply left-padded.
+        With it, each row is the cached header, then padding, then the description and PREFIX,
+        so the header is at the same positions in every row and one cache serves the whole batch
+        """
+        import torch
+
+        if not self.prefix_cache:
+            prompts = [self.prompt_for(description) for description in descriptions]
+            return self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.device), None
+        suffixes = [f"{description}\n\n{PREFIX}" for description in descriptions]
+        tail = self.tokenizer(suffixes, return_tensors="pt", padding=True, add_special_tokens=False).to(self.device)
+        header = self.header_ids.expand(len(descriptions), -1)
+        inputs = {
+            "input_ids": torch.cat([header, tail["input_ids"]], dim=1),
+            "attention_mask": torch.cat([torch.ones_like(header), tail["attention_mask"]], dim=1),
+        }
+        cache = copy.deepcopy(self.header_cache)
+        cache.batch_repeat_interleave(len(descriptions))
+        return inputs, cache
+
+    @staticmethod
+    def get_price(text: str) -> float:
+        """
+        Pluck the price out of the model's completion
+        """
+        contents = text.split(PREFIX)[-1].replace(',', '')
+        match = re.search(r"[-+]?\d*\.\d+|\d+", contents)
+        return float(match.group()) if match else 0
+
+    def price(self, description: str) -> float:
+        """
+        Estimate the price of the described product
+        """
+        return self.price_batch([description])[0]
+
+    def price_batch(self, descriptions: List[str]) -> List[float]:
+        """
+        Estimate the prices of several products with a single call to generate
+        The prompts are left-padded so that every completion starts at the same position
+        :param descriptions: the products to be estimated
+        :return: a price for each description, in the same order
+        """
+        import torch
+        from transformers import set_seed
+
+        if not descriptions:
+            return []
+        self.load()
+        set_seed(42)
+        inputs, cache = self.encode(descriptions)
+        with torch.no_grad():
+            if self.decoding == "expected":
+                return self.expected_prices(inputs, cache)
+            options = {} if cache is None else dict(past_key_values=cache)
+            if self.decoding == "numeric":
+                options.update(do_sample=False, logits_processor=[NumericLogitsProcessor(self, inputs["input_ids"].shape[1])])
+            outputs = self.model.generate(**inputs, max_new_tokens=5, num_return_sequences=1,
+                                          pad_token_id=self.tokenizer.pad_token_id, **options)
+        completions = self.tokenizer.batch_decode(outputs[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+        return [self.get_price(completion) for completion in completions]
+
+    def number_tokens(self):
+        """
+        Find the tokens made only of digits and at most one decimal point, which is all a price needs
+        Cached after the first call, as it decodes the whole vocabulary
+        """
+        if self._number_tokens is None:
+            pieces = self.tokenizer.batch_decode([[token_id] for token_id in range(len(self.tokenizer))])
+            self._number_tokens = {token_id: piece for token_id, piece in enumerate(pieces)
+                                   if piece == "." or piece.replace(".", "", 1).isdigit()}
+        return self._number_tokens
+
+    def forward(self, inputs, cache=None):
+        """
+        Run the prompts through the model once, skipping the header when its keys and values are cached.
+        Positions are counted from each row's first real token, so a left-padded row is scored
+        at the same positions as it would be on its own
+        """
+        position_ids = (inputs["attention_mask"].cumsum(dim=-1) - 1).clamp(min=0)
+        if cache is None:
+            return self.model(input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"],
+                              position_ids=position_ids)
+        start = self.header_ids.shape[1]
+        return self.model(input_ids=inputs["input_ids"][:, start:], attention_mask=inputs["attention_mask"],
+                          position_ids=position_ids[:, start:], past_key_values=cache)
+
+    def expected_prices(self, inputs, cache=None) -> List[float]:
+        """
+        Rather than generating, take the expected price over the model's probability
+        distribution for the first token, restricted to whole-number tokens.
+        Prices in our data are below $1,000, which the Llama 3 tokenizer encodes as a single token
+        """
+        import torch
+
+        integers = [(token_id, int(piece)) for token_id, piece in self.number_tokens().items() if piece.isdigit()]
+        token_ids = torch.tensor([token_id for token_id, _ in integers], device=self.device)
+        values = torch.tensor([value for _, value in integers], dtype=torch.float32, device=self.device)
+        logits = self.forward(inputs, cache).logits[:, -1, :].float()
+        probabilities = torch.softmax(logits[:, token_ids], dim=-1)
+        return (probabilities * values).sum(dim=-1).tolist()
+
+
+class NumericLogitsProcessor:
+    """
+    A logits processor for generate that only lets the model write a number:
+    the first token must be digits, later tokens digits or a single decimal point,
+    and generation ends as soon as the model's preferred next token isn't numeric.
+    """
+
+    def __init__(self, pricer: PricerModel, prompt_length: int):
+        import torch
+
+        numbers = pricer.number_tokens()
+        self.prompt_length = prompt_length
+        self.tokenizer = pricer.tokenizer
+        self.eos = pricer.tokenizer.eos_token_id
+        self.digits = torch.tensor([token_id for token_id, piece in numbers.items() if piece.isdigit()])
+        self.numbers = torch.tensor(list(numbers.keys()))
+        self.number_set = set(numbers.keys())
+        self.dotted = {token_id for token_id, piece in numbers.items() if "." in piece}
+
+    def __call__(self, input_ids, scores):
+        import torch
+
+        mask = torch.full_like(scores, float("-inf"))
+        for row in range(scores.shape[0]):
+            generated = input_ids[row, self.prompt_length:].tolist()
+            if not generated:
+                mask[row, self.digits.to(scores.device)] = 0
+                continue
+            text = self.tokenizer.decode(generated, skip_special_tokens=True)
+            preferred = int(scores[row].argmax())
+            if generated[-1] == self.eos or preferred not in self.number_set or ("." in text and preferred in self.dotted):
+                mask[row, self.eos] = 0
+            elif "." in text:
+                mask[row, self.digits.to(scores.device)] = 0
+            else:
+                mask[row, self.numbers.to(scores.device)] = 0
+        return scores + mask
+
+
+class MicroBatcher:
+    """
+    Merges single price requests that arrive within a few milliseconds of each other
+    into one price_batch call, so concurrent callers share a forward pass.
+    Every call to the model is made by its one worker thread, so the model is never run concurrently
+    """
+
+    def __init__(self, pricer: PricerModel, max_batch_size: int = 16, max_wait_ms: float = 5):
+        """
+        :param pricer: the loaded model to run batches on
+        :param max_batch_size: the most requests to merge into one batch
+        :param max_wait_ms: how long the first request in a batch waits for others to join it
+        """
+        self.pricer = pricer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, description: str) -> Future:
+        future = Future()
+        self.requests.put((description, future))
+        return future
+
+    def price(self, description: str) -> float:
+        """
+        Queue this description and block until its batch has been priced
+        """
+        return self.submit(description).result()
+
+    def price_batch(self, descriptions: List[str]) -> List[float]:
+        """
+        Queue these descriptions together and block until they've all been priced;
+        they're split into batches of at most max_batch_size, which other requests may join
+        """
+        futures = [self.submit(description) for description in descriptions]
+        return [future.result() for future in futures]
+
+    def collect(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            try:
+                prices = self.pricer.price_batch([description for description, _ in batch])
+                for (_, future), price in zip(batch, prices):
+                    future.set_result(price)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+def merge_adapter(base_model: str, finetuned_model: str, revision: Optional[str], output: str,
+                  dtype: str = "bfloat16") -> str:
+    """
+    Fold the LoRA adapter into the base model's weights and save the result as a standalone checkpoint.
+    The merge has to happen on unquantized weights, so the checkpoint is saved in dtype
+    and quantized to 4 bits when it's loaded, just like the base model.
+    The checkpoint is also the starting point for a GGUF export with llama.cpp's convert_hf_to_gguf.py
+    :param base_model: the name or local directory of the base model
+    :param finetuned_model: the name or local directory of the LoRA adapter
+    :param revision: the revision of the adapter to merge
+    :param output: the directory to save the merged model and tokenizer to
+    :param dtype: the torch dtype to merge and save in
+    :return: the output directory
+    """
+    import torch
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from peft import PeftModel
+
+    tokenizer = AutoTokenizer.from_pretrained(base_model)
+    model = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype=getattr(torch, dtype), low_cpu_mem_usage=True)
+    model = PeftModel.from_pretrained(model, finetuned_model, revision=revision).merge_and_unload()
+    temp = output + ".partial"
+    model.save_pretrained(temp, safe_serialization=True, max_shard_size="2GB")
+    tokenizer.save_pretrained(temp)
+    write_manifest(temp, describe_files(temp), base_model=base_model, adapter=finetuned_model, revision=revision)
+    if os.path.exists(output):
+        shutil.rmtree(output)
+    os.replace(temp, output)
+    return output
+
+
+_resident: Optional[PricerModel] = None
+
+
+def resident_model(volume=None, **kwargs) -> PricerModel:
+    """
+    Return the pricer held by this process, loading it on first use.
+    Inside a Modal container this means one load per container, not one per call
+    :param volume: if provided, the weights come from this persistent Modal Volume,
+    using the merged checkpoint if there is one
+    """
+    global _resident
+    if _resident is None:
+        pricer = PricerModel.merged(volume, **kwargs) if volume is not None else PricerModel(**kwargs)
+        _resident = pricer.load()
+    return _resident
+
+
+def benchmark(pricer: PricerModel, descriptions: List[str], batch_size: int = 16):
+    """
+    Compare pricing one at a time with pricing in batches, reporting throughput
+    """
+    pricer.load()
+    start = time.perf_counter()
+    for description in descriptions:
+        pricer.price(description)
+    serial = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(0, len(descriptions), batch_size):
+        pricer.price_batch(descriptions[i:i + batch_size])
+    batched = time.perf_counter() - start
+    print(f"Serial:  {len(descriptions)/serial:,.1f} prices/sec")
+    print(f"Batched: {len(descriptions)/batched:,.1f} prices/sec (batch size {batch_size}, {serial/batched:.1f}x)")
+
+
+def benchmark_prefix_cache(pricer: PricerModel, descriptions: List[str], batch_size: int = 16):
+    """
+    Measure the prefill time saved by reusing the cached keys and values of the prompt header
+    """
+    import torch
+
+    pricer.load()
+    if pricer.header_cache is None:
+        pricer.cache_header()
+    timings = {}
+    for use_cache in (False, True):
+        pricer.prefix_cache = use_cache
+        start = time.perf_counter()
+        with torch.no_grad():
+            for i in range(0, len(descriptions), batch_size):
+                inputs, cache = pricer.encode(descriptions[i:i + batch_size])
+                pricer.forward(inputs, cache)
+        timings[use_cache] = time.perf_counter() - start
+    saved = timings[False] - timings[True]
+    print(f"Prefill without header cache: {timings[False]*1000:,.0f} ms")
+    print(f"Prefill with header cache:    {timings[True]*1000:,.0f} ms ({saved*1000:,.0f} ms saved, {saved/timings[False]*100:.0f}%)")
+
+
+def per_token_latency(pricer: PricerModel, descriptions: List[str], tokens: int = 5) -> float:
+    """
+    The average time to generate one token, pricing one description at a time
+    """
+    import torch
+
+    pricer.load()
+    start = time.perf_counter()
+    with torch.no_grad():
+        for description in descriptions:
+            inputs, cache = pricer.encode([description])
+            options = {} if cache is None else dict(past_key_values=cache)
+            pricer.model.generate(**inputs, max_new_tokens=tokens, min_new_tokens=tokens, do_sample=False,
+                                  pad_token_id=pricer.tokenizer.pad_token_id, **options)
+    return (time.perf_counter() - start) / (len(descriptions) * tokens)
+
+
+def benchmark_merge(adapter: PricerModel, merged: PricerModel, descriptions: List[str]):
+    """
+    Compare the base model wrapped with the PEFT adapter against the merged checkpoint:
+    setup time, per-token latency, and how closely their prices agree
+    :param adapter: an unloaded pricer made from the base model and adapter
+    :param merged: an unloaded pricer made from the merged checkpoint
+    """
+    results = {}
+    for name, pricer in (("Adapter", adapter), ("Merged", merged)):
+        start = time.perf_counter()
+        pricer.load()
+        setup = time.perf_counter() - start
+        latency = per_token_latency(pricer, descriptions)
+        results[name] = pricer.price_batch(descriptions)
+        print(f"{name:8} setup {setup:6.1f}s, {latency*1000:7.2f} ms/token ({pricer.timings.report()})")
+    differences = [abs(a - b) for a, b in zip(results["Adapter"], results["Merged"])]
+    print(f"Prices differ by ${sum(differences)/len(differences):,.2f} on average, ${max(differences):,.2f} at most")
+
+
+if __name__ == "__main__":
+    import sys
+    model_name = sys.argv[1] if len(sys.argv) > 1 else LOCAL_MODEL
+    descriptions = [f"Product number {i}: a usb condenser microphone with a {i} foot cable" for i in range(64)]
+    pricer = PricerModel.local(model_name)
+    benchmark(pricer, descriptions)
+    benchmark_prefix_cache(pricer, descriptions)
@@ -0,0 +1,113 @@
+import os
+from typing import List, Tuple
+import numpy as np
+from sklearn.manifold import TSNE
+from embedding_store import DB, QuantizedEmbeddingStore
+
+PROJECTION_FILE = os.path.join(DB, "projection_3d.npz")
+
+
+def fetch_embeddings(collection, offset: int, limit: int) -> Tuple[np.ndarray, List[str], List[str]]:
+    """
+    Return the vectors, documents and categories of a slice of the collection
+    Vectors come from the quantized embedding store when it has been built
+    """
+    if limit <= 0:
+        return np.empty((0, 0), dtype=np.float32), [], []
+    if QuantizedEmbeddingStore.exists():
+        store = QuantizedEmbeddingStore()
+        if offset + limit <= len(store):
+            ids = store.ids[offset:offset + limit]
+            documents = collection.get(ids=ids, include=['documents'])['documents']
+            return store.vectors(offset, offset + limit), documents, store.categories(offset, offset + limit)
+    result = collection.get(include=['embeddings', 'documents', 'metadatas'], limit=limit, offset=offset)
+    vectors = np.array(result['embeddings'], dtype=np.float32)
+    categories = [metadata['category'] for metadata in result['metadatas']]
+    return vectors, result['documents'], categories
+
+
+class ProjectionCache:
+    """
+    A 3D t-SNE projection of the products collection for the Price is Right plot.
+    The expensive t-SNE fit happens once and is saved alongside the vector store;
+    products added to the collection afterwards are placed out-of-sample, at the
+    distance-weighted average position of their nearest neighbours in the fitted sample.
+    At most max_datapoints products are plotted: new products are placed in the order they were added
+    while there's room, and the saved count only moves past the products that have been placed.
+    The cache is refitted when VERSION changes, when the sample size changes,
+    or when the collection shrinks (meaning it has been rebuilt).
+    """
+
+    VERSION = 1
+    NEIGHBOURS = 10
+
+    def __init__(self, path: str = PROJECTION_FILE):
+        self.path = path
+
+    def load(self, max_datapoints: int):
+        """
+        Return the saved projection, or None if it's missing or out of date
+        """
+        if not os.path.exists(self.path):
+            return None
+        data = dict(np.load(self.path))
+        if int(data["version"]) != self.VERSION or int(data["max_datapoints"]) != max_datapoints:
+            return None
+        return data
+
+    def save(self, data) -> None:
+        temp = self.path + ".tmp.npz"
+        np.savez(temp, **data)
+        os.replace(temp, self.path)
+
+    def fit(self, collection, max_datapoints: int):
+        vectors, documents, categories = fetch_embeddings(collection, 0, max_datapoints)
+        tsne = TSNE(n_components=3, random_state=42, n_jobs=-1)
+        coordinates = tsne.fit_transform(vectors)
+        return {
+            "version": np.array(self.VERSION),
+            "max_datapoints": np.array(max_datapoints),
+            "count": np.array(collection.count()),
+            "sample": vectors.astype(np.float32),
+            "coordinates": coordinates.astype(np.float32),
+            "documents": np.array(documents),
+            "categories": np.array(categories),
+        }
+
+    def place(self, sample: np.ndarray, coordinates: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        """
+        Position new vectors in the fitted projection without refitting t-SNE
+        :param sample: the vectors that t-SNE was fitted on
+        :param coordinates: their 3D positions
+        :param vectors: the new vectors to place
+        :return: a 3D position for each new vector
+        """
+        k = min(self.NEIGHBOURS, len(sample))
+        distances = (vectors ** 2).sum(axis=1, keepdims=True) - 2 * vectors @ sample.T + (sample ** 2).sum(axis=1)
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        weights = 1.0 / (np.sqrt(np.maximum(np.take_along_axis(distances, nearest, axis=1), 0)) + 1e-6)
+        weights /= weights.sum(axis=1, keepdims=True)
+        return (coordinates[nearest] * weights[:, :, None]).sum(axis=1)
+
+    def projection(self, collection, max_datapoints: int = 1000) -> Tuple[List[str], np.ndarray, List[str]]:
+        """
+        Return the documents, 3D coordinates and categories to plot,
+        fitting t-SNE only if there's no usable saved projection
+        """
+        count = collection.count()
+        data = self.load(max_datapoints)
+        if data is None or count < int(data["count"]):
+            data = self.fit(collection, max_datapoints)
+            self.save(data)
+        elif count > int(data["count"]):
+            added = count - int(data["count"])
+            room = max_datapoints - len(data["coordinates"])
+            vectors, documents, categories = fetch_embeddings(collection, int(data["count"]), min(added, room))
+            if len(vectors):
+                placed = self.place(data["sample"], data["coordinates"], vectors)
+                data["coordinates"] = np.concatenate([data["coordinates"], placed.astype(np.float32)])
+                data["documents"] = np.concatenate([data["documents"], np.array(documents)])
+                data["categories"] = np.concatenate([data["categories"], np.array(categories)])
+                data["count"] = np.array(int(data["count"]) + len(vectors))
+                self.save(data)
+        return data["documents"].tolist(), data["coordinates"], data["categories"].tolist()
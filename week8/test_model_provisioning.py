@@ -0,0 +1,51 @@
+import os
+import time
+import threading
+import pytest
+
+huggingface_hub = pytest.importorskip("huggingface_hub")
+
+import model_provisioning
+from model_provisioning import provision, verify
+
+FILES = ["model.safetensors", "config.json"]
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    """
+    Stand in for the Hub: each download writes the files slowly, so concurrent downloads overlap
+    """
+    calls = []
+
+    def snapshot_download(repo_id, revision=None, local_dir=None, **kwargs):
+        calls.append(local_dir)
+        for name in FILES:
+            with open(os.path.join(local_dir, name), "wb") as file:
+                file.write(b"x" * 1000)
+            time.sleep(0.05)
+
+    monkeypatch.setattr(huggingface_hub, "snapshot_download", snapshot_download)
+    monkeypatch.setattr(model_provisioning, "expected_checksums", lambda repo_id, revision: dict.fromkeys(FILES))
+    return calls
+
+
+def test_model_is_downloaded_once(tmp_path, downloads):
+    path = provision("org/model", "abc", root=str(tmp_path))
+    assert verify(path)
+    assert provision("org/model", "abc", root=str(tmp_path)) == path
+    assert len(downloads) == 1
+
+
+def test_concurrent_cold_starts_each_use_their_own_folder(tmp_path, downloads):
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(provision("org/model", "abc", root=str(tmp_path))))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(paths) == 4 and len(set(paths)) == 1
+    assert verify(paths[0])
+    assert len(set(downloads)) == len(downloads)
+    assert os.listdir(os.path.dirname(paths[0])) == [os.path.basename(paths[0])]
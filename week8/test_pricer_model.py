@@ -0,0 +1,50 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+tokenizers = pytest.importorskip("tokenizers")
+
+from pricer_model import PricerModel
+
+WORDS = ["How", "much", "does", "this", "cost", "to", "the", "nearest", "dollar", "?", "Price", "is", "$",
+         "a", "red", "kettle", "with", "steel", "handle", "and", "blue", "lid", "phone", "case"]
+DESCRIPTIONS = [
+    "a red kettle",
+    "a blue phone case with a steel handle and a red lid",
+    "phone case",
+]
+
+
+@pytest.fixture(scope="module")
+def model_dir(tmp_path_factory):
+    """
+    A tiny random GPT-2 and a word-level tokenizer that knows the prompt and the numbers up to 999,
+    saved to disk so PricerModel loads them the way it loads the real model.
+    GPT-2 has absolute position embeddings, so a padded row scored at the wrong positions gets a different price
+    """
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+    vocab = {token: index for index, token in enumerate(["[UNK]", "</s>"] + WORDS + [str(n) for n in range(1000)])}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    path = tmp_path_factory.mktemp("tiny-gpt2")
+    PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]", eos_token="</s>").save_pretrained(path)
+    torch.manual_seed(0)
+    config = GPT2Config(vocab_size=len(vocab), n_embd=32, n_layer=2, n_head=4, n_positions=128,
+                        bos_token_id=vocab["</s>"], eos_token_id=vocab["</s>"])
+    GPT2LMHeadModel(config).save_pretrained(path)
+    return str(path)
+
+
+@pytest.mark.parametrize("prefix_cache", [False, True])
+def test_batched_prices_match_single_prices(model_dir, prefix_cache):
+    pricer = PricerModel.local(model_dir, decoding="expected", prefix_cache=prefix_cache).load()
+    batched = pricer.price_batch(DESCRIPTIONS)
+    single = [pricer.price(description) for description in DESCRIPTIONS]
+    assert batched == pytest.approx(single, abs=1e-3)
+
+
+def test_prompt_matches_the_training_format():
+    from pricer_model import QUESTION, PREFIX
+    assert PricerModel.prompt_for("a red kettle") == f"{QUESTION}\n\na red kettle\n\n{PREFIX}"
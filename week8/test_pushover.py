@@ -0,0 +1,148 @@
+import ssl
+import time
+import shutil
+import asyncio
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+
+from agents.pushover import PushoverTransport, PushoverError
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """
+    A local stand-in for Pushover: it answers each request with the next status in the server's plan, or 200.
+    "drop" reads the request and closes the connection without answering;
+    "idle close" answers as if keeping the connection alive, then closes it
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests += 1
+        action = self.server.plan.pop(0) if self.server.plan else 200
+        if action == "drop":
+            self.close_connection = True
+            return
+        status = 200 if action == "idle close" else action
+        body = b'{"status":1,"request":"abc"}'
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if action == "idle close":
+            self.close_connection = True
+
+
+@pytest.fixture(scope="module")
+def certificate(tmp_path_factory):
+    if not shutil.which("openssl"):
+        pytest.skip("openssl is needed to make a certificate for the stand-in")
+    path = tmp_path_factory.mktemp("pushover")
+    cert, key = path / "cert.pem", path / "key.pem"
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+                    "-keyout", str(key), "-out", str(cert)], check=True, capture_output=True)
+    return str(cert), str(key)
+
+
+@pytest.fixture
+def server(certificate):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(*certificate)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    server.plan, server.requests, server.connections = [], 0, 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def transport(server, certificate):
+    context = ssl.create_default_context(cafile=certificate[0])
+    context.check_hostname = False
+    transport = PushoverTransport("token", "user", host="127.0.0.1", port=server.server_address[1],
+                                  timeout=2, retries=2, backoff=0.01, context=context)
+    yield transport
+    transport.close()
+
+
+def test_connection_is_reused(server, transport):
+    for _ in range(3):
+        assert transport.send("hello")["status"] == 1
+    assert server.requests == 3
+    assert server.connections == 1
+
+
+def test_server_error_is_retried(server, transport):
+    server.plan = [500, 503]
+    assert transport.send("hello")["status"] == 1
+    assert server.requests == 3
+
+
+def test_retries_run_out(server, transport):
+    server.plan = [500, 500, 500]
+    with pytest.raises(PushoverError, match="500"):
+        transport.send("hello")
+    assert server.requests == 3
+
+
+def test_client_error_is_not_retried(server, transport):
+    server.plan = [400]
+    with pytest.raises(PushoverError, match="400"):
+        transport.send("hello")
+    assert server.requests == 1
+
+
+def test_sent_notification_without_response_is_not_retried(server, transport):
+    server.plan = ["drop"]
+    with pytest.raises(PushoverError, match="isn't retried"):
+        transport.send("hello")
+    assert server.requests == 1
+
+
+def test_unsent_notification_is_retried(transport, monkeypatch):
+    transport.port = 1
+    delays = []
+    monkeypatch.setattr(time, "sleep", delays.append)
+    with pytest.raises(PushoverError, match="Could not reach"):
+        transport.send("hello")
+    assert delays == [0.01, 0.02]
+
+
+def test_connection_closed_while_idle_is_replaced(server, transport):
+    server.plan = ["idle close"]
+    transport.send("hello")
+    time.sleep(0.1)
+    assert transport.send("hello")["status"] == 1
+    assert server.requests == 2
+    assert server.connections == 2
+
+
+def test_send_async(server, transport):
+    async def send(plan):
+        server.plan = plan
+        async with aiohttp.ClientSession() as session:
+            return await transport.send_async("hello", session)
+
+    assert asyncio.run(send([500]))["status"] == 1
+    assert server.requests == 2
+    with pytest.raises(PushoverError, match="400"):
+        asyncio.run(send([400]))
+    assert server.requests == 3
+    with pytest.raises(PushoverError, match="isn't retried"):
+        asyncio.run(send(["drop"]))
+    assert server.requests == 4
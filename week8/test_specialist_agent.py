@@ -0,0 +1,160 @@
+import time
+import asyncio
+import threading
+import pytest
+
+from agents import specialist_agent
+from agents.pricer_backends import PricerBackend
+from agents.pricer_warmer import PricerWarmer
+from agents.specialist_agent import SpecialistAgent
+
+
+class FakePricer(PricerBackend):
+    """
+    A stand-in for the Pricer on Modal that counts its calls, and can be made to take a while
+    """
+
+    def __init__(self, name: str = "fake", estimate: float = 100.0, delay: float = 0):
+        self.name = name
+        self.estimate = estimate
+        self.delay = delay
+        self.prices = []
+        self.wake_ups = 0
+        self.lock = threading.Lock()
+
+    def price(self, description: str) -> float:
+        with self.lock:
+            self.prices.append(description)
+        time.sleep(self.delay)
+        return self.estimate
+
+    async def price_async(self, description: str) -> float:
+        with self.lock:
+            self.prices.append(description)
+        await asyncio.sleep(self.delay)
+        return self.estimate
+
+    def wake_up(self) -> str:
+        with self.lock:
+            self.wake_ups += 1
+        time.sleep(self.delay)
+        return "ok"
+
+
+def wait_for(condition, timeout: float = 2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_warmer_pings_only_once_idle():
+    backend = FakePricer()
+    warmer = PricerWarmer(backend, idle_threshold=0.1)
+    assert warmer.check() is not None
+    assert warmer.check() is None
+    time.sleep(0.15)
+    assert warmer.check() is not None
+    assert backend.wake_ups == 2
+
+
+def test_warmer_is_ready_after_a_call_until_the_scaledown_window():
+    warmer = PricerWarmer(FakePricer(), scaledown_window=0.1)
+    assert not warmer.is_ready()
+    warmer.ping()
+    assert warmer.is_ready()
+    time.sleep(0.15)
+    assert not warmer.is_ready()
+
+
+def test_warmer_counts_slow_calls_as_cold_starts():
+    warmer = PricerWarmer(FakePricer(delay=0.05), cold_threshold=0.01)
+    warmer.ping()
+    warmer.record(0.001)
+    assert len(warmer.cold_latencies) == 1 and len(warmer.warm_latencies) == 1
+    warmer.record_failure()
+    assert not warmer.is_ready()
+
+
+def test_keep_warm_is_opt_in():
+    assert SpecialistAgent(FakePricer(), allow_fallback=False).warmer.thread is None
+    agent = SpecialistAgent(FakePricer(), allow_fallback=False, keep_warm=True)
+    assert agent.warmer.thread.is_alive()
+    agent.warmer.stop()
+
+
+def test_estimates_are_cached_by_revision_and_description(monkeypatch):
+    backend = FakePricer()
+    agent = SpecialistAgent(backend, allow_fallback=False)
+    agent.price("a kettle")
+    agent.price("a kettle")
+    assert backend.prices == ["a kettle"]
+    monkeypatch.setattr(specialist_agent, "REVISION", "another revision")
+    agent.price("a kettle")
+    assert backend.prices == ["a kettle", "a kettle"]
+
+
+def test_cache_evicts_the_least_recently_used(monkeypatch):
+    backend = FakePricer()
+    agent = SpecialistAgent(backend, allow_fallback=False)
+    monkeypatch.setattr(agent, "CACHE_SIZE", 2)
+    for description in ["a", "b", "a", "c", "a", "b"]:
+        agent.price(description)
+    assert backend.prices == ["a", "b", "c", "b"]
+
+
+def test_identical_concurrent_requests_share_one_call():
+    backend = FakePricer(delay=0.05)
+    agent = SpecialistAgent(backend, allow_fallback=False)
+
+    async def price_together():
+        return await asyncio.gather(*(agent.price_async("a kettle") for _ in range(5)),
+                                    agent.price_async("a phone case"))
+
+    assert asyncio.run(price_together()) == [100.0] * 6
+    assert sorted(backend.prices) == ["a kettle", "a phone case"]
+
+
+def test_cancelling_one_waiter_leaves_the_call_for_the_others():
+    backend = FakePricer(delay=0.05)
+    agent = SpecialistAgent(backend, allow_fallback=False)
+
+    async def price_with_an_impatient_caller():
+        patient = asyncio.ensure_future(agent.price_async("a kettle"))
+        with pytest.raises(asyncio.TimeoutError):
+            await agent.price_async("a kettle", timeout=0.01)
+        return await patient
+
+    assert asyncio.run(price_with_an_impatient_caller()) == 100.0
+    assert backend.prices == ["a kettle"]
+
+
+def test_fallback_while_cold_then_remote_once_warm():
+    remote, local = FakePricer("remote", 100.0), FakePricer("local", 90.0)
+    agent = SpecialistAgent(remote, fallback=local)
+    assert agent.is_ready()
+    assert agent.price("a kettle") == 90.0
+    wait_for(agent.warmer.is_ready)
+    assert remote.wake_ups == 1
+    assert agent.price("a kettle") == 100.0
+    assert local.prices == ["a kettle"] and remote.prices == ["a kettle"]
+
+
+def test_fallback_when_the_remote_call_fails():
+    class Failing(FakePricer):
+        def price(self, description: str) -> float:
+            raise ConnectionError("no container")
+
+    local = FakePricer("local", 90.0)
+    agent = SpecialistAgent(Failing(), fallback=local)
+    agent.warmer.record(0.01)
+    assert agent.price("a kettle") == 90.0
+    assert not agent.warmer.is_ready()
+
+
+def test_without_a_fallback_the_specialist_is_only_ready_when_warm():
+    agent = SpecialistAgent(FakePricer(), fallback=FakePricer("local"), allow_fallback=False)
+    assert agent.fallback is None
+    assert not agent.is_ready()
+    agent.warmer.ping()
+    assert agent.is_ready()
@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import pickle
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+import joblib
+import sklearn
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from embedding_store import DB, QuantizedEmbeddingStore
+from compiled_forest import CompiledForest, MODEL_FILE
+from agents.ensemble_agent import ENSEMBLE_FILE, ENSEMBLE_WITHOUT_SPECIALIST_FILE, LinearCombiner
+from agents.specialist_agent import SpecialistAgent
+from agents.frontier_agent import FrontierAgent
+from agents.random_forest_agent import RandomForestAgent
+
+# Trains the random forest and the ensemble reproducibly, outside the day2.4 notebook:
+#   python train_models.py forest      streams the vectors in batches and grows the forest a few trees per batch
+#   python train_models.py ensemble    prices test items with all three agents in parallel and fits the ensemble,
+#                                      along with the ensemble used while the specialist is cold, which leaves it out
+#   python train_models.py             both, in that order
+# Each model is written to its usual file for the agents to load, with a JSON file of metadata beside it,
+# and a copy of both is kept under models/ with the version in the name
+
+MODELS_DIR = "models"
+RANDOM_STATE = 42
+BATCH_SIZE = 50000
+N_ESTIMATORS = 100
+ENSEMBLE_ITEMS = slice(1000, 1250)
+WORKERS = 8
+# How long to wait for the specialist's remote model to start before giving up on training the ensemble
+SPECIALIST_TIMEOUT = 600
+
+
+def vector_batches(collection, batch_size: int = BATCH_SIZE) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Yield (vectors, prices) in batches from the quantized embedding store if it's been built,
+    otherwise page through the Chroma collection; either way only one batch is held in memory
+    """
+    if QuantizedEmbeddingStore.exists():
+        yield from QuantizedEmbeddingStore().iter_batches(batch_size)
+        return
+    for start in range(0, collection.count(), batch_size):
+        result = collection.get(include=['embeddings', 'metadatas'], limit=batch_size, offset=start)
+        prices = np.array([metadata['price'] for metadata in result['metadatas']], dtype=np.float64)
+        yield np.asarray(result['embeddings'], dtype=np.float32), prices
+
+
+def train_forest(collection, n_estimators: int = N_ESTIMATORS, batch_size: int = BATCH_SIZE,
+                 random_state: int = RANDOM_STATE) -> Tuple[RandomForestRegressor, dict]:
+    """
+    Train the random forest with bounded memory, using warm_start to add trees one batch of data at a time.
+    Each batch grows its share of the trees, so every tree is fitted to a bootstrap sample of one batch
+    rather than of the whole collection; the products were shuffled before they went into the collection,
+    so every batch is a fair sample of it
+    :return: the model, and metadata describing how it was trained
+    """
+    count = collection.count()
+    batches = max(1, math.ceil(count / batch_size))
+    model = RandomForestRegressor(n_estimators=0, warm_start=True, random_state=random_state, n_jobs=-1)
+    rows = 0
+    for index, (vectors, prices) in enumerate(vector_batches(collection, batch_size)):
+        target = round(n_estimators * (index + 1) / batches)
+        rows += len(vectors)
+        if target > len(getattr(model, "estimators_", [])):
+            model.n_estimators = target
+            model.fit(vectors, prices)
+            logging.info(f"Random forest has {target} trees after {rows:,} of {count:,} rows")
+    metadata = {
+        "rows": rows,
+        "source": "quantized store" if QuantizedEmbeddingStore.exists() else "chroma",
+        "n_estimators": len(model.estimators_),
+        "batch_size": batch_size,
+        "random_state": random_state,
+    }
+    return model, metadata
+
+
+def description(item) -> str:
+    return item.prompt.split("to the nearest dollar?\n\n")[1].split("\n\nPrice is $")[0]
+
+
+def ensemble_features(specialists: List[float], frontiers: List[float], random_forests: List[float]) -> pd.DataFrame:
+    """
+    The features the ensemble is trained on, made exactly as EnsembleAgent makes them to price a deal
+    """
+    rows = [LinearCombiner.features(s, f, r) for s, f, r in zip(specialists, frontiers, random_forests)]
+    return pd.DataFrame(rows, columns=LinearCombiner.FEATURES)
+
+
+def ensemble_features_without_specialist(frontiers: List[float], random_forests: List[float]) -> pd.DataFrame:
+    rows = [LinearCombiner.features_without_specialist(f, r) for f, r in zip(frontiers, random_forests)]
+    return pd.DataFrame(rows, columns=LinearCombiner.FEATURES_WITHOUT_SPECIALIST)
+
+
+def collect_predictions(items, specialist, frontier, random_forest, workers: int = WORKERS) -> pd.DataFrame:
+    """
+    Price the items with each of the three agents, to train the ensemble on.
+    The specialist and frontier spend their time waiting on Modal and OpenAI, so their calls
+    run concurrently on a thread pool; the random forest prices every item in one batch meanwhile
+    """
+    texts = [description(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        specialists = pool.map(specialist.price, texts)
+        frontiers = pool.map(frontier.price, texts)
+        random_forests = random_forest.price_batch(texts)
+        return ensemble_features(list(specialists), list(frontiers), random_forests)
+
+
+def remote_specialist(timeout: float = SPECIALIST_TIMEOUT):
+    """
+    A SpecialistAgent that only ever uses the fine-tuned model on Modal, once it has woken up.
+    The ensemble must be trained on the same model that it combines at inference, so the local
+    fallback, which would otherwise stand in while the remote model is cold, is disabled
+    """
+    specialist = SpecialistAgent(allow_fallback=False)
+    deadline = time.monotonic() + timeout
+    while not specialist.is_ready():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"The specialist's {specialist.backend.name} model didn't wake up within {timeout}s")
+        specialist.warm_up()
+        time.sleep(5)
+    return specialist
+
+
+def fit_ensemble(X: pd.DataFrame, y: pd.Series, features: List[str],
+                 specialist_backend: Optional[str] = None) -> Tuple[LinearRegression, dict]:
+    """
+    :param specialist_backend: the name of the backend that made the specialist's estimates, if they're a feature
+    """
+    np.random.seed(RANDOM_STATE)
+    model = LinearRegression()
+    model.fit(X, y)
+    metadata = {
+        "items": f"test[{ENSEMBLE_ITEMS.start}:{ENSEMBLE_ITEMS.stop}]",
+        **({"specialist_backend": specialist_backend} if specialist_backend else {}),
+        "features": features,
+        "coefficients": dict(zip(features, model.coef_.tolist())),
+        "intercept": float(model.intercept_),
+        "r2": float(model.score(X, y)),
+    }
+    return model, metadata
+
+
+def train_ensemble(collection, test) -> List[Tuple[str, LinearRegression, dict]]:
+    """
+    Fit the ensemble, and the ensemble the agents use while the specialist is cold, on the same predictions
+    :return: the file, model and metadata of each
+    """
+    items = test[ENSEMBLE_ITEMS]
+    specialist = remote_specialist()
+    X = collect_predictions(items, specialist, FrontierAgent(collection), RandomForestAgent())
+    y = pd.Series([item.price for item in items])
+    X_without_specialist = ensemble_features_without_specialist(X['Frontier'].tolist(), X['RandomForest'].tolist())
+    return [
+        (ENSEMBLE_FILE, *fit_ensemble(X, y, LinearCombiner.FEATURES, specialist.backend.name)),
+        (ENSEMBLE_WITHOUT_SPECIALIST_FILE,
+         *fit_ensemble(X_without_specialist, y, LinearCombiner.FEATURES_WITHOUT_SPECIALIST)),
+    ]
+
+
+def save(model, filename: str, metadata: dict) -> str:
+    """
+    Write the model with its metadata under models/ with a version in the name,
+    then replace the file the agents load, so a half-written file is never picked up
+    :return: the version
+    """
+    version = datetime.now().strftime("%Y-%m-%d_%H.%M.%S")
+    metadata = {
+        "version": version,
+        "sklearn": sklearn.__version__,
+        "numpy": np.__version__,
+        **metadata,
+    }
+    stem = os.path.splitext(filename)[0]
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    versioned = os.path.join(MODELS_DIR, f"{stem}-{version}.pkl")
+    joblib.dump(model, versioned)
+    with open(os.path.join(MODELS_DIR, f"{stem}-{version}.json"), "w") as file:
+        json.dump(metadata, file, indent=2)
+    shutil.copyfile(versioned, filename + ".tmp")
+    os.replace(filename + ".tmp", filename)
+    with open(f"{stem}.json", "w") as file:
+        json.dump(metadata, file, indent=2)
+    logging.info(f"Saved {filename} version {version}")
+    return version
+
+
+if __name__ == "__main__":
+    import chromadb
+    from dotenv import load_dotenv
+
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(message)s")
+    load_dotenv()
+    stage = sys.argv[1] if len(sys.argv) > 1 else "all"
+    client = chromadb.PersistentClient(path=DB)
+    collection = client.get_or_create_collection('products')
+    if stage in ("forest", "all"):
+        forest, metadata = train_forest(collection)
+        save(forest, MODEL_FILE, metadata)
+        print(CompiledForest.compile(forest, source=MODEL_FILE).report())
+    if stage in ("ensemble", "all"):
+        with open('test.pkl', 'rb') as file:
+            test = pickle.load(file)
+        for filename, ensemble, metadata in train_ensemble(collection, test):
+            save(ensemble, filename, metadata)
+            print(f"{filename}: {json.dumps(metadata['coefficients'], indent=2)}")